@@ -17,8 +17,9 @@ from src.path_planning.planning_executor import PlanningExecutor
 from src.path_planning.simple_planning import SimpleTrajectoryPlanner
 from src.grasping.grasp_execution import GraspExecution
 
-def run_exp(config: Dict[str, Any]):
+def run_exp(config: Dict[str, Any], log_interval: int = 100):
     # Example Experiment Runner File
+    # log_interval: print the per-step checks only every log_interval steps
     print("Simulation Start:")
     print(config['world_settings'], config['robot_settings'])
     object_root_path = ycb_objects.getDataPath()
@@ -26,8 +27,14 @@ def run_exp(config: Dict[str, Any]):
     obj_names = [file.split('/')[-1] for file in files]
     sim = Simulation(config)
     for obj_name in obj_names:
+        state_id = None
         for tstep in range(10):
-            sim.reset(obj_name)
+            # load the URDFs once per object, later timesteps restore the snapshot
+            if state_id is None:
+                sim.reset(obj_name)
+                state_id = sim.save_state()
+            else:
+                sim.restore(state_id)
             print((f"Object: {obj_name}, Timestep: {tstep},"
                    f" pose: {sim.get_ground_tuth_position_object}"))
             pos, ori = sim.robot.pos, sim.robot.ori
@@ -42,18 +49,21 @@ def run_exp(config: Dict[str, Any]):
             ee_pos, ee_ori = sim.robot.get_ee_pose()
             print(f"Robot End Effector Position: {ee_pos}")
             print(f"Robot End Effector Orientation: {ee_ori}")
+            obs_position_guess = np.zeros((2, 3))
+            goal_guess = np.zeros((7,))
             for i in range(10000):
                 sim.step()
                 # for getting renders
                 # rgb, depth, seg = sim.get_ee_renders()
                 # rgb, depth, seg = sim.get_static_renders()
-                obs_position_guess = np.zeros((2, 3))
+                if i % log_interval != 0:
+                    continue
                 print((f"[{i}] Obstacle Position-Diff: "
                        f"{sim.check_obstacle_position(obs_position_guess)}"))
-                goal_guess = np.zeros((7,))
                 print((f"[{i}] Goal Obj Pos-Diff: "
                        f"{sim.check_goal_obj_pos(goal_guess)}"))
                 print(f"[{i}] Goal Satisfied: {sim.check_goal()}")
+        sim.remove_state(state_id)
     sim.close()
 
 
@@ -185,6 +195,7 @@ if __name__ == "__main__":
             replan_steps=args.replan_steps,
             method="RRT*_PF_Plan" # can also choose "Potential_Plan","RRT*_Plan","Hard_Code","RRT*_PF_Plan" 
         )
+        planning_executor.close()
 
     input("\nPress Enter to close the simulation...")
     
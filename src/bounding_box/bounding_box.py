@@ -91,14 +91,19 @@ class BoundingBox:
         if not collected_data:
             return None
             
-        # Use first point cloud as reference
-        merged_pcd = collected_data[0]['point_cloud']
+        # Use (a copy of) the first point cloud as the initial registration target
+        merged_pcd = o3d.geometry.PointCloud(collected_data[0]['point_cloud'])
         
         # ICP parameters
         threshold = 0.005  # Distance threshold
         trans_init = np.eye(4)  # Initial transformation
+        voxel_size = 0.005
         
-        # Merge remaining point clouds
+        # The target only gets downsampled once it has doubled since the last
+        # downsampling, instead of after every view
+        downsampled_size = len(merged_pcd.points)
+        
+        # Register each remaining view against the union of the views merged so far
         for i in range(1, len(collected_data)):
             current_pcd = collected_data[i]['point_cloud']
             
@@ -109,17 +114,18 @@ class BoundingBox:
                 o3d.pipelines.registration.ICPConvergenceCriteria(max_iteration=50)
             )
             
-            # Transform current point cloud
-            current_pcd.transform(reg_p2p.transformation)
-            
-            # Merge point clouds
-            merged_pcd += current_pcd
+            # Transform a copy so the caller's point cloud is left untouched, then append it
+            merged_pcd += o3d.geometry.PointCloud(current_pcd).transform(reg_p2p.transformation)
             
-            # Optional: Use voxel downsampling to remove duplicate points
-            merged_pcd = merged_pcd.voxel_down_sample(voxel_size=0.005)
+            if len(merged_pcd.points) > 2 * downsampled_size:
+                merged_pcd = merged_pcd.voxel_down_sample(voxel_size=voxel_size)
+                downsampled_size = len(merged_pcd.points)
             
             print(f"Merged point cloud {i+1}, fitness: {reg_p2p.fitness}")
         
+        # Use voxel downsampling to remove duplicate points
+        merged_pcd = merged_pcd.voxel_down_sample(voxel_size=voxel_size)
+        
         return merged_pcd
     
     def compute_obb(self):
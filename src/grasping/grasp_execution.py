@@ -1,3 +1,4 @@
+import numpy as np
 import pybullet as p
 import time
 
@@ -20,9 +21,11 @@ class GraspExecution:
             sim: Simulation environment object
         """
         self.sim = sim
-        self.ik_solver = DifferentialIKSolver(sim.robot.id, sim.robot.ee_idx, damping=0.05)
-        self.trajectory_planner = SimpleTrajectoryPlanner
         self.config = config
+        # PyBullet's native IK by default; the custom solver is kept as a fallback
+        self.use_native_ik = config["robot_settings"].get("use_native_ik", True)
+        self.ik_solver = None if self.use_native_ik else DifferentialIKSolver(sim.robot.id, sim.robot.ee_idx, damping=0.05)
+        self.trajectory_planner = SimpleTrajectoryPlanner
         self.bbox_center = bbox_center
         self.bbox_rotation_matrix = bbox_rotation_matrix
     
@@ -42,7 +45,7 @@ class GraspExecution:
         start_joints = self.sim.robot.get_joint_positions()
         
         # Solve IK for pre-grasp position
-        target_joints = self.ik_solver.solve(pose1_pos, pose1_orn, start_joints, max_iters=50, tolerance=0.001)
+        target_joints = self._solve_ik(pose1_pos, pose1_orn, start_joints)
         
         if target_joints is None:
             print("IK cannot be solved, cannot move to pre-grasp position")
@@ -55,8 +58,9 @@ class GraspExecution:
         # Open gripper
         self.open_gripper()
         
-        # Move to final grasp position
-        current_joints = self.sim.robot.get_joint_positions()
+        # Move to final grasp position, continuing from the last commanded setpoint
+        # (the arm has settled there while the gripper opened)
+        current_joints = trajectory[-1]
         pose2_trajectory = self.trajectory_planner.generate_cartesian_trajectory(
             self.sim.robot.id, 
             self.sim.robot.arm_idx, 
@@ -64,7 +68,8 @@ class GraspExecution:
             current_joints, 
             pose2_pos, 
             pose2_orn, 
-            steps=100
+            steps=100,
+            ik_fn=self._solve_ik
         )
         
         if not pose2_trajectory:
@@ -79,6 +84,81 @@ class GraspExecution:
         # Close gripper to grasp object
         self.close_gripper()
         
+    def _solve_ik(self, target_pos, target_orn, seed_joints, max_iters=50, tolerance=0.001,
+                  pos_tol=0.01, orn_tol=0.1):
+        """Solve IK for the arm joints
+        
+        Parameters:
+        target_pos: Target end-effector position
+        target_orn: Target end-effector orientation (quaternion)
+        seed_joints: Joint positions used as rest pose / initial guess
+        pos_tol: Largest accepted end-effector position error of the solution (m)
+        orn_tol: Largest accepted end-effector orientation error of the solution (rad)
+        
+        Returns:
+        List of arm joint positions, or None if the solution misses the target
+        """
+        if not self.use_native_ik:
+            joint_positions = self.ik_solver.solve(target_pos, target_orn, seed_joints, max_iters=max_iters, tolerance=tolerance)
+        else:
+            joint_positions = self._solve_native_ik(target_pos, target_orn, seed_joints, max_iters, tolerance)
+        
+        # Neither solver reports failure, so check the forward-kinematics residual
+        pos_err, orn_err = self._fk_residual(joint_positions, target_pos, target_orn)
+        if pos_err > pos_tol or orn_err > orn_tol:
+            print(f"IK solution misses the target (position error {pos_err:.4f} m, orientation error {orn_err:.4f} rad)")
+            return None
+        return joint_positions
+    
+    def _solve_native_ik(self, target_pos, target_orn, seed_joints, max_iters, tolerance):
+        """Solve IK for the arm joints with PyBullet's calculateInverseKinematics"""
+        robot = self.sim.robot
+        n_arm = len(robot.arm_idx)
+        l_lim = np.asarray(robot.lower_limits)
+        u_lim = np.asarray(robot.upper_limits)
+        
+        # null-space arrays must cover every movable joint, so pad with the gripper joints
+        gripper_states = p.getJointStates(robot.id, robot.gripper_idx)
+        gripper_pos = [state[0] for state in gripper_states]
+        lower = list(l_lim) + [0.0] * len(gripper_pos)
+        upper = list(u_lim) + [0.04] * len(gripper_pos)
+        ranges = list(u_lim - l_lim) + [0.04] * len(gripper_pos)
+        rest = list(seed_joints)[:n_arm] + gripper_pos
+        
+        joint_positions = p.calculateInverseKinematics(
+            robot.id,
+            robot.ee_idx,
+            target_pos,
+            target_orn,
+            lowerLimits=lower,
+            upperLimits=upper,
+            jointRanges=ranges,
+            restPoses=rest,
+            maxNumIterations=max_iters,
+            residualThreshold=tolerance
+        )
+        return list(joint_positions[:n_arm])
+    
+    def _fk_residual(self, joint_positions, target_pos, target_orn):
+        """End-effector position (m) and orientation (rad) error of arm joint positions
+        
+        The arm is set to joint_positions for the forward kinematics and put back
+        (positions and velocities) afterwards.
+        """
+        robot = self.sim.robot
+        saved_states = p.getJointStates(robot.id, robot.arm_idx)
+        for joint_idx, q in zip(robot.arm_idx, joint_positions):
+            p.resetJointState(robot.id, joint_idx, q)
+        ee_pos, ee_orn = p.getLinkState(robot.id, robot.ee_idx, computeForwardKinematics=True)[:2]
+        for joint_idx, state in zip(robot.arm_idx, saved_states):
+            p.resetJointState(robot.id, joint_idx, state[0], targetVelocity=state[1])
+        
+        pos_err = float(np.linalg.norm(np.asarray(target_pos) - np.asarray(ee_pos)))
+        # rotation angle between the two unit quaternions
+        dot = min(abs(float(np.dot(ee_orn, target_orn))) / np.linalg.norm(target_orn), 1.0)
+        orn_err = 2.0 * np.arccos(dot)
+        return pos_err, orn_err
+    
     def _execute_trajectory(self, trajectory, sim_steps_per_point=1):
         """Execute trajectory
         
@@ -94,14 +174,16 @@ class GraspExecution:
             # execute multiple simulation steps to ensure smooth movement
             for _ in range(sim_steps_per_point):
                 self.sim.step()
-                time.sleep(1/240.0)  # match the default step of the simulation
+                if self.sim.gui_enabled:
+                    time.sleep(1/240.0)  # match the default step of the simulation
     
     def _wait(self, seconds):
         """Wait for specified seconds"""
         steps = int(seconds * 240)
         for _ in range(steps):
             self.sim.step()
-            time.sleep(1/240.)
+            if self.sim.gui_enabled:
+                time.sleep(1/240.)
     
     def open_gripper(self, width=0.04):
         """Open robot gripper"""
@@ -137,7 +219,7 @@ class GraspExecution:
         current_joints = self.sim.robot.get_joint_positions()
         
         # Solve IK for lifted position
-        lift_target_joints = self.ik_solver.solve(lift_pos, current_ee_orn, current_joints, max_iters=50, tolerance=0.001)
+        lift_target_joints = self._solve_ik(lift_pos, current_ee_orn, current_joints)
         
         if lift_target_joints is None:
             print("IK cannot be solved for lifted position, cannot lift object")
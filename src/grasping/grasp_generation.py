@@ -1,18 +1,61 @@
+import math
 import numpy as np
 import open3d as o3d
 import pybullet as p
 
-from typing import Tuple, Sequence, Optional
+from typing import List, Tuple, Sequence, Optional
+from scipy.spatial import cKDTree
 from scipy.spatial.transform import Rotation
 from src.grasping.mesh import visualize_3d_objs,create_grasp_mesh
 
 
+# alpha of the alpha-shape mesh the containment rays are cast against
+_CONTAINMENT_ALPHA = 0.016
+
+
+def _norm3(v):
+    """Euclidean norm of a 3-vector without the dispatch overhead of np.linalg.norm."""
+    return math.sqrt(v[0] * v[0] + v[1] * v[1] + v[2] * v[2])
+
 
 class GraspGeneration:
-    def __init__(self, bbox_center, bbox_rotation_matrix, sim):
+    def __init__(self, bbox_center, bbox_rotation_matrix, sim, seed: Optional[int] = None):
         self.bbox_center = bbox_center
         self.bbox_rotation_matrix = bbox_rotation_matrix
         self.sim = sim
+        # one PCG64 generator for all grasp sampling; pass a seed for reproducible candidates
+        self._rng = np.random.default_rng(seed)
+        # id(object_pcd) -> (object_pcd, scene, object_center, object_tree), shared by all containment checks
+        self._scene_cache = {}
+
+    def _get_object_scene(self, object_pcd: o3d.geometry.PointCloud):
+        """
+        Return the raycasting scene, centroid and KD-tree of an object point cloud, building them on first use.
+
+        Args:
+            object_pcd: Point Cloud of the target object
+
+        Returns:
+            tuple: (RaycastingScene of the alpha-shape mesh, object center point, cKDTree of the points)
+        """
+        key = id(object_pcd)
+        cached = self._scene_cache.get(key)
+        # the cloud itself is kept in the entry so a recycled id can never hit a stale scene
+        if cached is not None and cached[0] is object_pcd:
+            return cached[1:]
+
+        points = np.asarray(object_pcd.points)
+        object_center = np.mean(points, axis=0)
+
+        obj_triangle_mesh = o3d.geometry.TriangleMesh.create_from_point_cloud_alpha_shape(pcd=object_pcd,
+                                                                                          alpha=_CONTAINMENT_ALPHA)
+        obj_triangle_mesh_t = o3d.t.geometry.TriangleMesh.from_legacy(obj_triangle_mesh)
+        scene = o3d.t.geometry.RaycastingScene()
+        scene.add_triangles(obj_triangle_mesh_t)
+        object_tree = cKDTree(points)
+
+        self._scene_cache[key] = (object_pcd, scene, object_center, object_tree)
+        return scene, object_center, object_tree
 
     def sample_grasps_state(
         self,
@@ -23,7 +66,7 @@ class GraspGeneration:
         min_point_rotated: np.ndarray = None,
         max_point_rotated: np.ndarray = None,
         center_rotated: np.ndarray = None
-    ) -> Sequence[Tuple[np.ndarray, np.ndarray]]:
+    ) -> Tuple[np.ndarray, np.ndarray]:
         """
         Generate multiple random grasp poses within the bounding box.
 
@@ -37,20 +80,13 @@ class GraspGeneration:
             center_rotated: Origin of the OBB rotated coordinate system in world coordinates
 
         Returns:
-            list: List of rotation matrices and translation vectors
+            tuple: (num_grasps, 3, 3) rotation matrices and (num_grasps, 3) translation vectors
         """
-        grasp_poses_list = []
         table_height = sim.robot.pos[2] + 0.01
         
-        grasp_points = []
-        grasp_directions = []  # save the grasp direction
-        
         obb_dims = max_point_rotated - min_point_rotated
-        # height_threshold = 0.15  # 15 centimeters
-        
         x_size = obb_dims[0]
         y_size = obb_dims[1]
-        z_size = obb_dims[2]
               
         bbox_x_axis = rotation_matrix[:, 0]  # X axis of the Bounding box
         bbox_y_axis = rotation_matrix[:, 1]  # Y axis of the Bounding box
@@ -63,63 +99,36 @@ class GraspGeneration:
             short_axis = bbox_y_axis
             long_axis = bbox_x_axis
               
-        # sample the position in the bounding box
-        for idx in range(num_grasps):
-            rotated_coords = np.zeros(3)
-            rotated_coords[0] = np.random.uniform(min_point_rotated[0], max_point_rotated[0])
-            rotated_coords[1] = np.random.uniform(min_point_rotated[1], max_point_rotated[1])
-            rotated_coords[2] = np.random.uniform(min_point_rotated[2], max_point_rotated[2])
-            
-            # convert the sampled point from the rotated coordinate system to the world coordinate system
-            grasp_center = np.dot(rotated_coords, rotation_matrix.T) + center_rotated
-            
-            # the grasp point is not lower than the table height
-            grasp_center[2] = max(grasp_center[2], table_height)
-            
-             
-            # Z axis is vertical downward
-            grasp_z_axis = np.array([0, 0, -1])
-            
-            # X axis (the thickness direction of the gripper) uses the long axis
-            grasp_x_axis = long_axis
-            
-            # Y axis (the opening direction of the gripper) uses the short axis
-            grasp_y_axis = short_axis
+        # Z axis is vertical downward
+        grasp_z_axis = np.array([0, 0, -1])
+        
+        # X axis (the thickness direction of the gripper) uses the long axis
+        grasp_x_axis = long_axis
+        
+        # Y axis (the opening direction of the gripper) uses the short axis
+        grasp_y_axis = short_axis
 
-            # ensure the coordinate system direction is correct
-            if np.dot(np.cross(grasp_x_axis, grasp_y_axis), grasp_z_axis) < 0:
-                grasp_y_axis = -grasp_y_axis
-    
-            # build the rotation matrix
-            R = np.column_stack((grasp_x_axis, grasp_y_axis, grasp_z_axis))
-            grasp_center = grasp_center - 0.05 * grasp_z_axis
-            # # save the rotation matrix for visualization
-            # grasp_directions.append(R)
-            
-            # add the grasp pose to the result list
-            grasp_poses_list.append((R, grasp_center))
-        
-        # # define the length of the sampling point axis and color
-        # axis_length = 0.05  # axis length
-        # x_color = [1, 0, 0]  # x axis red
-        # y_color = [0, 1, 0]  # y axis green
-        # z_color = [0, 0, 1]  # z axis blue
-        
-        # for i, (point, direction) in enumerate(zip(grasp_points, grasp_directions)):
-        #     # use the red sphere to represent the grasp point
-        #     p.addUserDebugPoints([point], [[1, 0, 0]], pointSize=5, lifeTime=0)
-            
-        #     # extract the direction vectors of the three axes
-        #     x_axis = direction[:, 0] * axis_length
-        #     y_axis = direction[:, 1] * axis_length
-        #     z_axis = direction[:, 2] * axis_length
-            
-        #     # draw the three axes
-        #     p.addUserDebugLine(point, np.array(point) + x_axis, x_color, lineWidth=2, lifeTime=0)
-        #     p.addUserDebugLine(point, np.array(point) + y_axis, y_color, lineWidth=2, lifeTime=0)
-        #     p.addUserDebugLine(point, np.array(point) + z_axis, z_color, lineWidth=2, lifeTime=0)
-            
-        return grasp_poses_list
+        # ensure the coordinate system direction is correct
+        if np.dot(np.cross(grasp_x_axis, grasp_y_axis), grasp_z_axis) < 0:
+            grasp_y_axis = -grasp_y_axis
+
+        # build the rotation matrix (the same for every sample)
+        R = np.column_stack((grasp_x_axis, grasp_y_axis, grasp_z_axis))
+        
+        # sample all positions in the bounding box at once
+        rotated_coords = self._rng.uniform(min_point_rotated, max_point_rotated, size=(num_grasps, 3))
+        
+        # convert the sampled points from the rotated coordinate system to the world coordinate system
+        grasp_centers = rotated_coords @ rotation_matrix.T + center_rotated
+        
+        # the grasp point is not lower than the table height
+        np.maximum(grasp_centers[:, 2], table_height, out=grasp_centers[:, 2])
+        grasp_centers -= 0.05 * grasp_z_axis
+        
+        # every grasp shares the same orientation, so the rotations are a read-only broadcast view
+        grasp_rotations = np.broadcast_to(R, (num_grasps, 3, 3))
+        
+        return grasp_rotations, grasp_centers
     
     def check_grasp_collision(
         self,
@@ -129,16 +138,17 @@ class GraspGeneration:
         num_colisions: int = 10,
         tolerance: float = 0.00001) -> bool:
 
-        # Combine gripper meshes
-        combined_gripper = o3d.geometry.TriangleMesh()
-        for mesh in grasp_meshes:
-            combined_gripper += mesh
+        # Combine gripper meshes in one allocation, offsetting each part's triangle indices
+        vertices = [np.asarray(mesh.vertices) for mesh in grasp_meshes]
+        offsets = np.cumsum([0] + [len(v) for v in vertices[:-1]])
+        triangles = [np.asarray(mesh.triangles) + offset for mesh, offset in zip(grasp_meshes, offsets)]
+        combined_gripper = o3d.geometry.TriangleMesh(
+            o3d.utility.Vector3dVector(np.concatenate(vertices)),
+            o3d.utility.Vector3iVector(np.concatenate(triangles).astype(np.int32))
+        )
 
-        # Sample points from mesh
-        num_points = 5000  # Number of points for subsampling both meshes
-        gripper_pcl = combined_gripper.sample_points_uniformly(number_of_points=num_points)
-        
         # Determine which object representation to use
+        num_points = 5000  # Number of points for subsampling both meshes
         if object_mesh is not None:
             object_pcl = object_mesh.sample_points_uniformly(number_of_points=num_points)
         elif object_pcd is not None:
@@ -146,18 +156,26 @@ class GraspGeneration:
         else:
             raise ValueError("Must provide at least one parameter from object_mesh or object_pcd")
 
-        # Build KD tree for object points
-        is_collision = False
-        object_kd_tree = o3d.geometry.KDTreeFlann(object_pcl)
-        collision_count = 0
-        for point in gripper_pcl.points:
-            [_, idx, distance] = object_kd_tree.search_knn_vector_3d(point, 1)
-            if distance[0] < tolerance:
-                collision_count += 1
-                if collision_count >= num_colisions:
-                    return True  # Collision detected
+        # tolerance is a squared distance (as returned by KDTreeFlann), so only object
+        # points inside the gripper AABB grown by sqrt(tolerance) can ever count.
+        # Surface samples never leave the vertex AABB, so crop before sampling the gripper.
+        gripper_vertices = np.asarray(combined_gripper.vertices)
+        object_points = np.asarray(object_pcl.points)
+        margin = np.sqrt(tolerance)
+        lower = gripper_vertices.min(axis=0) - margin
+        upper = gripper_vertices.max(axis=0) + margin
+        object_points = object_points[np.all((object_points >= lower) & (object_points <= upper), axis=1)]
+        if len(object_points) == 0:
+            return False
 
-        return is_collision
+        # Sample points from mesh
+        gripper_pcl = combined_gripper.sample_points_uniformly(number_of_points=num_points)
+        gripper_points = np.asarray(gripper_pcl.points)
+
+        # one batched nearest-neighbour query; misses beyond the margin come back as inf
+        distances, _ = cKDTree(object_points).query(gripper_points, k=1, distance_upper_bound=margin, workers=-1)
+        collision_count = np.count_nonzero(distances < margin)
+        return collision_count >= num_colisions
 
     def check_grasp_containment(
         self,
@@ -167,7 +185,8 @@ class GraspGeneration:
         object_pcd: o3d.geometry.PointCloud,
         num_rays: int,
         rotation_matrix: np.ndarray, # rotation-mat
-        visualize_rays: bool = False  # Whether to visualize rays in PyBullet
+        visualize_rays: bool = False,  # Whether to visualize rays in PyBullet
+        verbose: bool = False  # Whether to print per-grasp diagnostics
     ) -> Tuple[bool, float, float]:
         """
         Checks if any line between the gripper fingers intersects with the object mesh.
@@ -180,6 +199,7 @@ class GraspGeneration:
             num_rays: Number of rays to cast
             rotation_matrix: Rotation matrix for the grasp
             visualize_rays: Whether to visualize rays in PyBullet
+            verbose: Whether to print per-grasp diagnostics
 
         Returns:
             tuple[bool, float, float]: 
@@ -190,78 +210,68 @@ class GraspGeneration:
         left_center = np.asarray(left_finger_center)
         right_center = np.asarray(right_finger_center)
 
-        # Calculate the height and bounding box of the object
-        points = np.asarray(object_pcd.points)
-        object_center = np.mean(points, axis=0)
-        print(f"Object center point: {object_center}")
-
-        obj_triangle_mesh = o3d.geometry.TriangleMesh.create_from_point_cloud_alpha_shape(pcd=object_pcd, 
-                                                                                          alpha=0.016)
-        
-        obj_triangle_mesh_t = o3d.t.geometry.TriangleMesh.from_legacy(obj_triangle_mesh)
-        scene = o3d.t.geometry.RaycastingScene()
-        scene.add_triangles(obj_triangle_mesh_t)
+        # Get the (cached) raycasting scene and center of the object
+        scene, object_center, _ = self._get_object_scene(object_pcd)
+        if verbose:
+            print(f"Object center point: {object_center}")
 
-        hand_width = np.linalg.norm(left_center-right_center)
+        hand_width = _norm3(left_center - right_center)
         ray_direction = (left_center - right_center)/hand_width
         finger_vec = np.array([0, 0, finger_length])
 
-        # Store ray start and end points for visualization
-        ray_start_points = []
-        ray_end_points = []
-        
         # ===== Calculate gripper width direction =====
-        print("Calculating gripper width direction...")
+        if verbose:
+            print("Calculating gripper width direction...")
         # Calculate vector in gripper width direction
         # First calculate finger_vec direction in world coordinates
         world_finger_vec = rotation_matrix.dot(finger_vec)
         # Calculate width direction vector
         width_direction = np.cross(ray_direction, world_finger_vec)
-        width_direction = width_direction / np.linalg.norm(width_direction)
+        width_direction = width_direction / _norm3(width_direction)
         
         # Define width direction parameters
         width_planes = 1  # Number of planes on each side in width direction
         width_offset = 0.01  # gripper thickness 0.02
         
         # ===== Generate multiple parallel ray planes =====
-        print("Generating multiple parallel ray planes...")
-        # Central plane (original plane)
-        rays = []
+        if verbose:
+            print("Generating multiple parallel ray planes...")
         contained = False
         
-        # Parallel planes on both sides in width direction
+        # Sampling points along the finger length, shared by every plane
+        steps = (np.arange(num_rays) / num_rays)[:, None]
+        base_points = right_center - 0.5 * world_finger_vec + steps * world_finger_vec
+        
+        # Parallel planes on both sides in width direction, filled slice by slice
+        ray_start_points = np.empty((2 * width_planes * num_rays, 3))
+        offset = 0
         for plane in range(1, width_planes + 1):
             # Calculate current plane offset
             current_offset = width_offset * plane
             
-            # Right side plane
-            for i in range(num_rays):
-                # Calculate sampling point along length direction, and offset in width direction
-                right_point = right_center - rotation_matrix.dot(0.5*finger_vec) + rotation_matrix.dot((i/num_rays)*finger_vec) + width_direction * current_offset
-                # Add ray from right offset point to left offset point
-                rays.append([np.concatenate([right_point, ray_direction])])
-                
-                # Store ray start and end points for visualization - using actual finger width
-                ray_start_points.append(right_point)
-                ray_end_points.append(right_point + ray_direction * hand_width)
-            
-            # Left side plane
-            for i in range(num_rays):
-                # Calculate sampling point along length direction, and offset in width direction
-                right_point = right_center - rotation_matrix.dot(0.5*finger_vec) + rotation_matrix.dot((i/num_rays)*finger_vec) - width_direction * current_offset
-                # Add ray from right offset point to left offset point
-                rays.append([np.concatenate([right_point, ray_direction])])
-                
-                # Store ray start and end points for visualization - using actual finger width
-                ray_start_points.append(right_point)
-                ray_end_points.append(right_point + ray_direction * hand_width)
-        
-        print(f"Total of {len(rays)} rays generated")
+            # Right side plane, then left side plane
+            for sign in (1, -1):
+                ray_start_points[offset:offset + num_rays] = base_points + sign * current_offset * width_direction
+                offset += num_rays
+        
+        # One float32 buffer for containment and depth rays, so they reach the raycaster without a copy
+        total_rays = len(ray_start_points)
+        all_rays = np.empty((total_rays + 2 * num_rays, 1, 6), dtype=np.float32)
+        
+        # Rays from right offset points towards the left finger
+        rays = all_rays[:total_rays]
+        rays[:, 0, :3] = ray_start_points
+        rays[:, 0, 3:] = ray_direction
+        
+        if verbose:
+            print(f"Total of {len(rays)} rays generated")
         
         # Visualize rays in PyBullet
         debug_lines = []
         if visualize_rays:
             print("Visualizing rays in PyBullet...")
+            # Ray end points are only needed here - using actual finger width
+            ray_end_points = ray_start_points + ray_direction * hand_width
             for start, end in zip(ray_start_points, ray_end_points):
                 line_id = p.addUserDebugLine(
                     start.tolist(), 
@@ -272,86 +282,180 @@ class GraspGeneration:
                 )
                 debug_lines.append(line_id)
         
-        # Execute ray casting
-        rays_t = o3d.core.Tensor(rays, dtype=o3d.core.Dtype.Float32)
-        ans = scene.cast_rays(rays_t)
-        
-        # Process ray casting results
-        rays_hit = 0
-        max_interception_depth_score = o3d.core.Tensor([0.0], dtype=o3d.core.Dtype.Float32)
-        center_rays_from_left = []
-        center_rays_from_right = []
-        # Track hits for left and right side ray planes
-        left_side_hit = False
-        right_side_hit = False
-    
+        # Depth rays along the center plane: left finger towards the right, right finger towards the left
+        depth_rays = all_rays[total_rays:]
+        depth_rays[:num_rays, 0, :3] = base_points + (left_center - right_center)
+        depth_rays[:num_rays, 0, 3:] = -ray_direction
+        depth_rays[num_rays:, 0, :3] = base_points
+        depth_rays[num_rays:, 0, 3:] = ray_direction
+        
+        # Execute ray casting, containment and depth rays in a single call
+        all_rays_t = o3d.core.Tensor.from_numpy(all_rays)
+        t_hit = scene.cast_rays(all_rays_t)['t_hit'].numpy()
+        t_left = t_hit[total_rays:total_rays + num_rays]
+        t_right = t_hit[total_rays + num_rays:]
+        
         # Process results for all rays
-        print("Processing ray casting results...")
-
-        for idx, hit_point in enumerate(ans['t_hit']):
-            # Use actual finger width to determine if ray hit the object
-            if hit_point < hand_width:
-                rays_hit += 1
-                
-                # Determine if ray belongs to left or right side plane
-                total_rays_count = len(rays)
-                half_rays_count = total_rays_count // 2
-                
-                if idx < half_rays_count:
-                    # Ray from right side plane
-                    right_side_hit = True
-                else:
-                    # Ray from left side plane
-                    left_side_hit = True
-                
-                # Only calculate depth for rays in the center plane (original plane)
-                if idx < num_rays:
-                    left_new_center = left_center - rotation_matrix.dot(0.5*finger_vec) + rotation_matrix.dot((idx/num_rays)*finger_vec)
-                    right_new_center = right_center - rotation_matrix.dot(0.5*finger_vec) + rotation_matrix.dot((idx/num_rays)*finger_vec)
-                    center_rays_from_left.append([np.concatenate([left_new_center, -ray_direction])])
-                    center_rays_from_right.append([np.concatenate([right_new_center, ray_direction])])
+        if verbose:
+            print("Processing ray casting results...")
         
-        # Only consider contained when both left and right side planes have at least one ray hit
-        contained = left_side_hit and right_side_hit
+        # Use actual finger width to determine if ray hit the object
+        hits = t_hit[:total_rays] < hand_width
+        rays_hit = int(np.count_nonzero(hits))
         
-        containment_ratio = 0.0
-        if contained:
-            # Process rays from left side (only for center plane)
-            if center_rays_from_left and center_rays_from_right:
-                left_rays_t = o3d.core.Tensor(center_rays_from_left, dtype=o3d.core.Dtype.Float32)
-                ans_left = scene.cast_rays(left_rays_t)
-                right_rays_t = o3d.core.Tensor(center_rays_from_left, dtype=o3d.core.Dtype.Float32)
-                ans_right = scene.cast_rays(right_rays_t)
-
-                if(len(ans_left['t_hit']) == len(ans_right['t_hit'])):
-                    hit_point_number = len(ans_left['t_hit'])
-                    for idx in range(hit_point_number):
-                        interception_depth = hand_width - ans_left['t_hit'][idx].item() - ans_right['t_hit'][idx].item()
-                        max_interception_depth_score = max(max_interception_depth_score, interception_depth)
-
+        # Only consider contained when both left and right side planes have at least one ray hit
+        half_rays_count = total_rays // 2
+        contained = bool(hits[:half_rays_count].any() and hits[half_rays_count:].any())
+        
+        max_interception_depth_score = 0.0
+        # Only calculate depth for rays in the center plane (original plane) that hit
+        center_hits = hits[:num_rays]
+        if contained and center_hits.any():
+            interception_depth = hand_width - t_left[center_hits] - t_right[center_hits]
+            max_interception_depth_score = max(max_interception_depth_score, float(interception_depth.max()))
 
-        print(f"the max interception depth is {max_interception_depth_score}")
+        if verbose:
+            print(f"the max interception depth is {max_interception_depth_score}")
         # Calculate overall ray hit ratio
-        total_rays = len(rays)
         containment_ratio = rays_hit / total_rays
-        print(f"Ray hit ratio: {containment_ratio:.4f} ({rays_hit}/{total_rays})")
+        if verbose:
+            print(f"Ray hit ratio: {containment_ratio:.4f} ({rays_hit}/{total_rays})")
         
         grasp_center = (left_center + right_center) / 2
         
-        distance_to_center = np.linalg.norm(grasp_center - object_center)
+        # The score only needs the squared distance, so skip the sqrt
+        center_offset = grasp_center - object_center
+        distance_sq = center_offset @ center_offset
         
         # Calculate distance score (closer distance gives higher score)
-        center_score = np.exp(-distance_to_center**2 / (2 * 0.05**2))
+        center_score = math.exp(-distance_sq / (2 * 0.05**2))
       
         # Incorporate both distance scores into final quality score
         final_quality = 0.1 * containment_ratio + 0.1 * center_score + 80 * (1-np.exp(-max_interception_depth_score * 1000))
         
-        print(f"Grasp center: {grasp_center}")
-        print(f"Total distance: {distance_to_center}m, Total distance score: {center_score}")
-        print(f"Final quality score: {final_quality}")
+        if verbose:
+            print(f"Grasp center: {grasp_center}")
+            print(f"Total distance: {math.sqrt(distance_sq)}m, Total distance score: {center_score}")
+            print(f"Final quality score: {final_quality}")
         
         return contained, final_quality
 
+    def check_grasp_containment_batch(
+        self,
+        left_finger_centers: Sequence[np.ndarray],
+        right_finger_centers: Sequence[np.ndarray],
+        finger_length: float,
+        object_pcd: o3d.geometry.PointCloud,
+        num_rays: int,
+        rotation_matrices: Sequence[np.ndarray]
+    ) -> List[Tuple[bool, float]]:
+        """
+        Batched version of check_grasp_containment for many grasp candidates.
+
+        The object scene is shared with check_grasp_containment, and the containment and depth
+        rays of all candidates are cast in a single call instead of once per grasp.
+
+        Args:
+            left_finger_centers: Left finger center of each grasp
+            right_finger_centers: Right finger center of each grasp
+            finger_length: Finger Length of the gripper.
+            object_pcd: Point Cloud of the target object
+            num_rays: Number of rays to cast along each finger
+            rotation_matrices: Rotation matrix of each grasp
+
+        Returns:
+            list[tuple[bool, float]]: (contained, final_quality) for each grasp
+        """
+        num_grasps = len(rotation_matrices)
+        if num_grasps == 0:
+            return []
+
+        scene, object_center, object_tree = self._get_object_scene(object_pcd)
+
+        width_planes = 1  # Number of planes on each side in width direction
+        width_offset = 0.01  # gripper thickness 0.02
+        finger_vec = np.array([0, 0, finger_length])
+        steps = (np.arange(num_rays) / num_rays)[:, None]
+        rays_per_grasp = 2 * width_planes * num_rays
+
+        left_centers = np.asarray(left_finger_centers, dtype=np.float64).reshape(num_grasps, 3)
+        right_centers = np.asarray(right_finger_centers, dtype=np.float64).reshape(num_grasps, 3)
+        rotation_matrices = np.asarray(rotation_matrices, dtype=np.float64).reshape(num_grasps, 3, 3)
+        hand_widths = np.linalg.norm(left_centers - right_centers, axis=1)
+        grasp_centers = (left_centers + right_centers) / 2
+
+        # Every ray hit lies inside the closing box between the fingers, and every point of the
+        # alpha-shape mesh lies within 2 * alpha of a cloud point. Grasps with no cloud point
+        # within that reach of their center cannot hit anything, so they skip ray casting.
+        reach = (np.sqrt((hand_widths / 2)**2 + (finger_length / 2)**2 + (width_planes * width_offset)**2)
+                 + 2 * _CONTAINMENT_ALPHA)
+        candidates = np.nonzero(object_tree.query_ball_point(grasp_centers, reach, return_length=True) > 0)[0]
+
+        contained = np.zeros(num_grasps, dtype=bool)
+        containment_ratio = np.zeros(num_grasps)
+        max_depth = np.zeros(num_grasps)
+
+        num_candidates = candidates.size
+        if num_candidates > 0:
+            cand_left = left_centers[candidates]
+            cand_right = right_centers[candidates]
+            cand_widths = hand_widths[candidates]
+
+            # Per-grasp closing direction, finger direction and width direction, all (M, 3)
+            ray_directions = (cand_left - cand_right) / cand_widths[:, None]
+            world_finger_vecs = np.einsum('nij,j->ni', rotation_matrices[candidates], finger_vec)
+            width_directions = np.cross(ray_directions, world_finger_vecs)
+            width_directions /= np.linalg.norm(width_directions, axis=1, keepdims=True)
+
+            # sampling points along the finger length, (M, num_rays, 3)
+            along_finger = steps[None] * world_finger_vecs[:, None, :] - 0.5 * world_finger_vecs[:, None, :]
+            right_points = cand_right[:, None, :] + along_finger
+
+            # width offsets in the same order as the single-grasp version: +plane, -plane for each plane
+            plane_offsets = width_offset * np.repeat(np.arange(1, width_planes + 1), 2) * np.tile([1, -1], width_planes)
+
+            # All rays of a grasp in one float32 buffer (the raycaster's native type):
+            # [containment rays | depth rays from the left finger | depth rays from the right finger]
+            all_rays = np.empty((num_candidates, rays_per_grasp + 2 * num_rays, 6), dtype=np.float32)
+            rays = all_rays[:, :rays_per_grasp]
+            rays[:, :, :3] = (right_points[:, None, :, :]
+                              + plane_offsets[None, :, None, None] * width_directions[:, None, None, :]
+                              ).reshape(num_candidates, rays_per_grasp, 3)
+            rays[:, :, 3:] = ray_directions[:, None, :]
+
+            depth_rays = all_rays[:, rays_per_grasp:rays_per_grasp + num_rays]
+            depth_rays[:, :, :3] = cand_left[:, None, :] + along_finger
+            depth_rays[:, :, 3:] = -ray_directions[:, None, :]
+
+            forward_depth_rays = all_rays[:, rays_per_grasp + num_rays:]
+            forward_depth_rays[:, :, :3] = right_points
+            forward_depth_rays[:, :, 3:] = ray_directions[:, None, :]
+
+            # One ray casting call for all candidates, handed over without a copy
+            rays_t = o3d.core.Tensor.from_numpy(all_rays.reshape(-1, 6))
+            t_hit = scene.cast_rays(rays_t)['t_hit'].numpy().reshape(num_candidates, rays_per_grasp + 2 * num_rays)
+            t_left = t_hit[:, rays_per_grasp:rays_per_grasp + num_rays]
+            t_right = t_hit[:, rays_per_grasp + num_rays:]
+            hits = t_hit[:, :rays_per_grasp] < cand_widths[:, None]
+
+            half_rays_count = rays_per_grasp // 2
+            cand_contained = hits[:, :half_rays_count].any(axis=1) & hits[:, half_rays_count:].any(axis=1)
+
+            # Depth only counts for contained grasps and center plane rays that hit
+            depth = cand_widths[:, None] - t_left - t_right
+            depth = np.where(hits[:, :num_rays] & cand_contained[:, None], depth, 0.0)
+
+            contained[candidates] = cand_contained
+            containment_ratio[candidates] = hits.sum(axis=1) / rays_per_grasp
+            max_depth[candidates] = np.maximum(depth.max(axis=1), 0.0)
+
+        center_offsets = grasp_centers - object_center
+        distance_sq = np.einsum('ij,ij->i', center_offsets, center_offsets)
+        center_score = np.exp(-distance_sq / (2 * 0.05**2))
+        final_quality = 0.1 * containment_ratio + 0.1 * center_score + 80 * (1 - np.exp(-max_depth * 1000))
+
+        return [(bool(c), float(q)) for c, q in zip(contained, final_quality)]
+
     def visualize_grasp_poses(self, 
                              pose1_pos, 
                              pose1_orn, 
@@ -408,13 +512,11 @@ class GraspGeneration:
         
         ee_target_pos = grasp_center
         
-        # Convert rotation matrix to quaternion
-        rot_world = Rotation.from_matrix(R)
-        euler_world = rot_world.as_euler('xyz', degrees=True)
+        # Convert rotation matrix to quaternion ([x, y, z, w], same convention as PyBullet)
+        pose2_orn = tuple(Rotation.from_matrix(R).as_quat())
         
         # Define pose 2 (final grasp pose)
         pose2_pos = ee_target_pos
-        pose2_orn = p.getQuaternionFromEuler([euler_world[0]/180*np.pi, euler_world[1]/180*np.pi, euler_world[2]/180*np.pi])
         
         # Calculate pose 1 (pre-grasp position) - move along z-axis of pose 2 backwards
         pose2_rot_matrix = R
@@ -435,10 +537,8 @@ class GraspGeneration:
         
         # Merge point clouds
         print("\nPreparing to merge point clouds...")
-        merged_pcd = None
-        for data in merged_point_clouds:
-            merged_pcd = data['point_cloud']
-
+        # The bounding box step already hands over a single merged cloud; use the last entry directly
+        merged_pcd = merged_point_clouds[-1]['point_cloud'] if merged_point_clouds else None
         
         if merged_pcd is None:
             print("Error: Cannot merge point clouds, grasping terminated")
@@ -449,9 +549,12 @@ class GraspGeneration:
         rotation_matrix = self.bbox_rotation_matrix
         
         # Get rotated boundary box coordinates
-        points_rotated = np.dot(np.asarray(merged_pcd.points) - center, rotation_matrix)
-        min_point_rotated = np.min(points_rotated, axis=0)
-        max_point_rotated = np.max(points_rotated, axis=0)
+        # (p - c) @ R == p @ R - c @ R, so the centered copy of the cloud is never materialized
+        # the projection runs in float32 (half the memory traffic); only the extremes go back to float64
+        points_rotated = np.asarray(merged_pcd.points, dtype=np.float32) @ np.asarray(rotation_matrix, dtype=np.float32)
+        center_rotated = np.asarray(center) @ rotation_matrix
+        min_point_rotated = points_rotated.min(axis=0).astype(np.float64) - center_rotated
+        max_point_rotated = points_rotated.max(axis=0).astype(np.float64) - center_rotated
         
         print(f"\nBoundary box information:")
         print(f"Centroid coordinates: {center}")
@@ -460,7 +563,7 @@ class GraspGeneration:
         
         # Generate grasping candidates
         print("\nGenerating grasping candidates...")
-        sampled_grasps_state = self.sample_grasps_state(
+        grasp_rotations, grasp_centers = self.sample_grasps_state(
             center, 
             num_grasps=2000, 
             sim=self.sim,
@@ -471,11 +574,12 @@ class GraspGeneration:
         )
         
         # Create mesh for each grasping candidate
+        sampled_grasps_state = []
         all_grasp_meshes = []
         
-        for grasp in sampled_grasps_state:
-            R, grasp_center = grasp
+        for R, grasp_center in zip(grasp_rotations, grasp_centers):
             gripper_meshes = create_grasp_mesh(center_point=grasp_center, rotation_matrix=R)
+            sampled_grasps_state.append((R, grasp_center))
             all_grasp_meshes.append(gripper_meshes)
         # Visualize all grasp meshes
         print("\nVisualizing all grasp candidates...")
@@ -503,30 +607,37 @@ class GraspGeneration:
 
         if_collision = False
 
+        # The object surface is the same for every candidate, so sample it once
+        # instead of letting check_grasp_collision resample the mesh per grasp
+        if object_name == "YcbPowerDrill":
+            collision_object_pcd = merged_pcd
+        else:
+            collision_object_pcd = obj_triangle_mesh.sample_points_uniformly(number_of_points=5000)
+
+        # Filter out colliding candidates first
+        collision_free = []
         for (pose, grasp_mesh) in zip(sampled_grasps_state, all_grasp_meshes):
-            if object_name == "YcbPowerDrill":
-                if_collision = self.check_grasp_collision(grasp_mesh, object_mesh=None, object_pcd = merged_pcd , num_colisions=1)
-            else:
-                if_collision = self.check_grasp_collision(grasp_mesh, object_mesh= obj_triangle_mesh, object_pcd = None , num_colisions=1)
+            if_collision = self.check_grasp_collision(grasp_mesh, object_mesh=None, object_pcd=collision_object_pcd, num_colisions=1)
 
             if not if_collision:
-                R, grasp_center = pose
-                
-                valid_grasp, grasp_quality = self.check_grasp_containment(
-                    grasp_mesh[0].get_center(), 
-                    grasp_mesh[1].get_center(),
-                    finger_length=0.05,
-                    object_pcd=merged_pcd,
-                    num_rays=50,
-                    rotation_matrix=pose[0],
-                    visualize_rays=False
-                )
-                
-                if valid_grasp and grasp_quality > highest_quality:
-                    highest_quality = grasp_quality
-                    best_grasp = pose
-                    best_grasp_mesh = grasp_mesh
-                    print(f"Found better grasp, quality: {grasp_quality}")
+                collision_free.append((pose, grasp_mesh))
+
+        # Then evaluate containment of all remaining candidates with batched ray casting
+        containment_results = self.check_grasp_containment_batch(
+            [grasp_mesh[0].get_center() for _, grasp_mesh in collision_free],
+            [grasp_mesh[1].get_center() for _, grasp_mesh in collision_free],
+            finger_length=0.05,
+            object_pcd=merged_pcd,
+            num_rays=50,
+            rotation_matrices=[pose[0] for pose, _ in collision_free]
+        )
+
+        for (pose, grasp_mesh), (valid_grasp, grasp_quality) in zip(collision_free, containment_results):
+            if valid_grasp and grasp_quality > highest_quality:
+                highest_quality = grasp_quality
+                best_grasp = pose
+                best_grasp_mesh = grasp_mesh
+                print(f"Found better grasp, quality: {grasp_quality}")
         
         if best_grasp is None:
             print("No valid grasp found!")
@@ -546,12 +657,7 @@ class GraspGeneration:
               
         # Add visualization code after finding the best grasp
         if best_grasp is not None and visualize:
-            # Create triangle mesh from point cloud
-            obj_triangle_mesh = o3d.geometry.TriangleMesh.create_from_point_cloud_alpha_shape(
-                pcd=merged_pcd, 
-                alpha=0.08
-            )
-            
+            # Reuse the object mesh built above (same cloud, same alpha)
             # Prepare list of meshes for visualization
             vis_meshes = [obj_triangle_mesh]
             
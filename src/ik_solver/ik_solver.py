@@ -2,21 +2,94 @@ import pybullet as p
 import pybullet_data
 import numpy as np
 
+from src.utils import njit
+
+
+@njit(cache=True)
+def _dls_step(J, error, damping, max_step=np.pi / 4, gamma_max=np.pi / 4):
+    """Selectively damped least squares joint update for Jacobian J and task-space error.
+
+    Buss & Kim's SDLS on top of the damped SVD pseudo-inverse
+    V diag(s / (s^2 + damping)) U^T: the contribution of each singular
+    direction i is clamped to gamma_i = min(1, N_i / M_i) * gamma_max, where
+    N_i is the task-space size of u_i and M_i bounds the joint motion needed
+    to move the end effector that far along it. Directions near a singularity
+    thus get a small bound while well-conditioned ones keep the full step.
+    The summed update is clamped to max_step. Clamping scales a vector down
+    until its largest joint component is at most the bound.
+    """
+    U, s, Vt = np.linalg.svd(J, full_matrices=False)
+    n = J.shape[1]
+    
+    # rho_j: end effector displacement per unit motion of joint j, position
+    # and orientation rows counted as separate targets
+    rho = np.empty(n)
+    for j in range(n):
+        rho[j] = np.linalg.norm(J[:3, j]) + np.linalg.norm(J[3:, j])
+    
+    delta_q = np.zeros(n)
+    for i in range(s.shape[0]):
+        if s[i] <= 1e-10:
+            continue
+        phi = (s[i] / (s[i] * s[i] + damping) * (U[:, i] @ error)) * Vt[i]
+        n_i = np.linalg.norm(U[:3, i]) + np.linalg.norm(U[3:, i])
+        m_i = np.abs(Vt[i]) @ rho / s[i]
+        gamma = min(1.0, n_i / m_i) * gamma_max
+        largest = np.max(np.abs(phi))
+        if largest > gamma:
+            phi *= gamma / largest
+        delta_q += phi
+    
+    largest = np.max(np.abs(delta_q))
+    if largest > max_step:
+        delta_q *= max_step / largest
+    return delta_q
+
+
+def _quat_err(q_cur, q_tgt):
+    """Vector part of q_tgt * conj(q_cur) (xyzw), sign-flipped to the shortest rotation.
+    
+    Same as p.getDifferenceQuaternion(q_cur, q_tgt)[:3] without the simulator call.
+    """
+    cx, cy, cz, cw = q_cur
+    tx, ty, tz, tw = q_tgt
+    w = tw * cw + tx * cx + ty * cy + tz * cz
+    x = cw * tx - tw * cx - (ty * cz - tz * cy)
+    y = cw * ty - tw * cy - (tz * cx - tx * cz)
+    z = cw * tz - tw * cz - (tx * cy - ty * cx)
+    if w < 0.0:
+        return np.array([-x, -y, -z])
+    return np.array([x, y, z])
 
 
 class DifferentialIKSolver:
-    def __init__(self, robot_id, ee_link_index, damping=0.001, use_shadow_client=True):
+    # joint limits of Franka Panda robot (panda_joint1 ... panda_joint7)
+    JOINT_LOWER_LIMITS = np.array([-2.9671, -1.8326, -2.9671, -3.1416, -2.9671, -0.0873, -2.9671])
+    JOINT_UPPER_LIMITS = np.array([2.9671, 1.8326, 2.9671, 0.0, 2.9671, 3.8223, 2.9671])
+    # warm start from the last solution when both the target and the seed are this close to the last solve
+    WARM_START_POS_TOL = 0.05    # m
+    WARM_START_ORN_TOL = 0.05    # norm of the quaternion error vector (~half the angle in rad)
+    WARM_START_JOINT_TOL = 0.5   # rad, largest per-joint difference
+
+    def __init__(self, robot_id, ee_link_index, damping=0.001, use_shadow_client=True, verbose=False):
         self.robot_id = robot_id
         self.ee_link_index = ee_link_index
         self.damping = damping
+        self.verbose = verbose # print per-iteration errors and joint limit warnings in solve
         self.use_shadow_client = use_shadow_client # whether to use shadow client for IK calculations
         
-        self.joint_indices = []
-        for i in range(p.getNumJoints(robot_id)):
-            joint_info = p.getJointInfo(robot_id, i)
-            if joint_info[2] == p.JOINT_REVOLUTE:
-                self.joint_indices.append(i)
+        # single pass over the joint table: revolute joints are controlled, and
+        # calculateJacobian expects positions for every movable joint (including the fingers)
+        joint_types = [p.getJointInfo(robot_id, i)[2] for i in range(p.getNumJoints(robot_id))]
+        self.joint_indices = tuple(i for i, joint_type in enumerate(joint_types)
+                                   if joint_type == p.JOINT_REVOLUTE)
         self.num_joints = len(self.joint_indices)
+        self._movable_joint_indices = tuple(i for i, joint_type in enumerate(joint_types)
+                                            if joint_type != p.JOINT_FIXED)
+        
+        # column of each controlled joint in the full Jacobian, to slice the arm part out
+        self._jacobian_columns = np.array([self._movable_joint_indices.index(i) for i in self.joint_indices],
+                                          dtype=np.intp)
         
         # Create shadow client for IK calculations if needed
         if self.use_shadow_client:
@@ -31,19 +104,30 @@ class DifferentialIKSolver:
                                              baseOrientation=robot_orn,
                                              useFixedBase=True, 
                                              physicsClientId=self.shadow_client_id)
+            # getBasePositionAndOrientation reports the base inertial frame, while loadURDF
+            # places the link frame there; reset it so both bases coincide
+            p.resetBasePositionAndOrientation(self.shadow_robot_id, robot_pos, robot_orn,
+                                              physicsClientId=self.shadow_client_id)
             
             # Copy the current joint states from the real robot to the shadow robot
-            for joint_idx in self.joint_indices:
-                joint_state = p.getJointState(self.robot_id, joint_idx)
-                joint_pos = joint_state[0]
-                joint_vel = 0.0
-                p.resetJointState(self.shadow_robot_id, joint_idx, 
-                                 targetValue=joint_pos,
-                                 targetVelocity=joint_vel,
-                                 physicsClientId=self.shadow_client_id)
+            joint_states = p.getJointStates(self.robot_id, self.joint_indices)
+            p.resetJointStatesMultiDof(self.shadow_robot_id, self.joint_indices,
+                                       targetValues=[[state[0]] for state in joint_states],
+                                       targetVelocities=[[0.0]] * self.num_joints,
+                                       physicsClientId=self.shadow_client_id)
         else:
             self.shadow_client_id = None
             self.shadow_robot_id = None
+        # joint positions last written to the shadow robot by _apply_joint_positions
+        self._shadow_sync_q = None
+        # last converged solution and the (target_pos, target_orn) it solved
+        self._last_q = None
+        self._last_target = None
+        
+        # engine parameter is global per client, so set it once rather than on every pose query
+        p.setPhysicsEngineParameter(enableConeFriction=0)
+        if self.use_shadow_client:
+            p.setPhysicsEngineParameter(enableConeFriction=0, physicsClientId=self.shadow_client_id)
         
         print(f"\nRobot Configuration:")
         print(f"Number of controlled joints: {self.num_joints}")
@@ -62,16 +146,11 @@ class DifferentialIKSolver:
             client_id = 0
             robot_id = self.robot_id
         
-        p.setPhysicsEngineParameter(enableConeFriction=0, physicsClientId=client_id)
-        
         ee_state = p.getLinkState(robot_id, self.ee_link_index, physicsClientId=client_id)
         return np.array(ee_state[0]), np.array(ee_state[1]) # pos and ori
 
-    def get_jacobian(self, joint_positions, use_shadow=True):
-        """Calculate the Jacobian matrix"""
-        delta = 1e-3
-        jac = np.zeros((6, len(self.joint_indices)))
-        
+    def get_jacobian(self, joint_positions, use_shadow=True, finite_difference=False):
+        """Calculate the 6xN end effector Jacobian (analytical unless finite_difference is set)"""
         if use_shadow and self.use_shadow_client:
             client_id = self.shadow_client_id
             robot_id = self.shadow_robot_id
@@ -79,114 +158,179 @@ class DifferentialIKSolver:
             client_id = 0
             robot_id = self.robot_id
         
-        p.setPhysicsEngineParameter(enableConeFriction=0, physicsClientId=client_id)
+        if finite_difference:
+            return self._get_jacobian_fd(robot_id, client_id, joint_positions)
+        return self._get_jacobian_analytical(robot_id, client_id, joint_positions)
+
+    def _get_jacobian_analytical(self, robot_id, client_id, joint_positions):
+        """Geometric Jacobian from a single calculateJacobian call"""
+        # non-controlled movable joints (fingers) keep their current positions
+        joint_states = p.getJointStates(robot_id, self._movable_joint_indices, physicsClientId=client_id)
+        all_positions = [state[0] for state in joint_states]
+        for col, pos in zip(self._jacobian_columns, joint_positions):
+            all_positions[col] = float(pos)
         
-        original_pos = joint_positions.copy()
+        zero_vec = [0.0] * len(all_positions)
+        jac_t, jac_r = p.calculateJacobian(robot_id, self.ee_link_index, [0.0, 0.0, 0.0],
+                                          all_positions, zero_vec, zero_vec,
+                                          physicsClientId=client_id)
+        jac = np.vstack([np.asarray(jac_t), np.asarray(jac_r)])
         
-        # Set initial joint positions
-        for idx, pos in zip(self.joint_indices, original_pos):
-            p.resetJointState(robot_id, idx, pos, physicsClientId=client_id)
-            
-        current_pos, current_orn = self.get_current_ee_pose(use_shadow=use_shadow)
+        return jac[:, self._jacobian_columns]
+
+    def _get_jacobian_fd(self, robot_id, client_id, joint_positions, delta=1e-3):
+        """Forward difference Jacobian around a single baseline pose
         
-        for i in range(len(self.joint_indices)):
-            joint_positions = original_pos.copy()
-            joint_positions[i] += delta
-            
-            # set joint state
-            for idx, pos in zip(self.joint_indices, joint_positions):
-                p.resetJointState(robot_id, idx, pos, physicsClientId=client_id)
-            
-            # new position and orientation
-            new_pos, new_orn = self.get_current_ee_pose(use_shadow=use_shadow)
+        Only the perturbed joint is written for each column and it is not restored
+        after the last one; the caller is responsible for setting the joints again.
+        """
+        jac = np.zeros((6, self.num_joints))
+        if client_id == self.shadow_client_id:
+            self._shadow_sync_q = None
+        
+        p.resetJointStatesMultiDof(robot_id, self.joint_indices, [[float(q)] for q in joint_positions],
+                                   physicsClientId=client_id)
+        current_pos, current_orn = p.getLinkState(robot_id, self.ee_link_index, physicsClientId=client_id)[:2]
+        current_pos = np.array(current_pos)
+        
+        for i, joint_idx in enumerate(self.joint_indices):
+            p.resetJointState(robot_id, joint_idx, joint_positions[i] + delta, physicsClientId=client_id)
+            new_pos, new_orn = p.getLinkState(robot_id, self.ee_link_index, physicsClientId=client_id)[:2]
             
             # pos jacobian 
-            jac[:3, i] = (new_pos - current_pos) / delta
+            jac[:3, i] = (np.array(new_pos) - current_pos) / delta
             
-            # ori jacobian 
-            # quaternion difference as angular velocity
-            orn_diff = p.getDifferenceQuaternion(current_orn.tolist(), new_orn.tolist(), physicsClientId=client_id)
-            jac[3:, i] = np.array(orn_diff[:3]) / delta
-        
-        # reset joint state
-        for idx, pos in zip(self.joint_indices, original_pos):
-            p.resetJointState(robot_id, idx, pos, physicsClientId=client_id)
+            # ori jacobian: the quaternion difference vector is half the rotation angle
+            orn_diff = p.getDifferenceQuaternion(current_orn, new_orn, physicsClientId=client_id)
+            jac[3:, i] = 2.0 * np.array(orn_diff[:3]) / delta
             
+            if i + 1 < self.num_joints:
+                p.resetJointState(robot_id, joint_idx, joint_positions[i], physicsClientId=client_id)
+        
         return jac
 
-    def solve(self, target_pos, target_orn, current_joint_positions, max_iters=50, tolerance=1e-3):
-        """solve IK using shadow client if available"""
-        current_joints = np.array(current_joint_positions)
-
-        # define joint limits of Franka Panda robot
-        joint_limits = [
-            (-2.9671, 2.9671),  # Joint 1 (panda_joint1)
-            (-1.8326, 1.8326),  # Joint 2 (panda_joint2)
-            (-2.9671, 2.9671),  # Joint 3 (panda_joint3)
-            (-3.1416, 0.0),     # Joint 4 (panda_joint4)
-            (-2.9671, 2.9671),  # Joint 5 (panda_joint5)
-            (-0.0873, 3.8223),  # Joint 6 (panda_joint6)
-            (-2.9671, 2.9671),  # Joint 7 (panda_joint7)
-        ]
+    def _apply_joint_positions(self, joint_positions):
+        """Write joint positions to the shadow robot if available, else to the real robot
+        
+        The shadow robot is only moved by this solver, so writes of the positions it
+        already holds are skipped.
+        """
+        target_values = [[float(q)] for q in joint_positions]
+        if self.use_shadow_client:
+            if self._shadow_sync_q is not None and np.array_equal(self._shadow_sync_q, joint_positions):
+                return
+            p.resetJointStatesMultiDof(self.shadow_robot_id, self.joint_indices, target_values,
+                                       physicsClientId=self.shadow_client_id)
+            self._shadow_sync_q = np.array(joint_positions, dtype=float)
+        else:
+            p.resetJointStatesMultiDof(self.robot_id, self.joint_indices, target_values)
+
+    def _pose_error(self, target_pos, target_orn):
+        """Position and orientation error of the current end effector pose"""
+        if self.use_shadow_client:
+            client_id, robot_id = self.shadow_client_id, self.shadow_robot_id
+        else:
+            client_id, robot_id = 0, self.robot_id
+        
+        current_pos, current_orn = p.getLinkState(robot_id, self.ee_link_index, physicsClientId=client_id)[:2]
+        pos_error = target_pos - np.array(current_pos)
+        
+        orn_error = _quat_err(current_orn, target_orn)
+        
+        # combine position and orientation error; the quaternion vector part is
+        # ~half the rotation angle, so scale it to match the angular Jacobian rows
+        error = np.concatenate([pos_error, 2.0 * orn_error])
+        return pos_error, orn_error, error
+
+    def solve(self, target_pos, target_orn, current_joint_positions, max_iters=50, tolerance=1e-3,
+              min_step_scale=1.0 / 16, min_delta_norm=1e-6, max_joint_step=0.3, warm_start=True):
+        """solve IK using shadow client if available
+        
+        Each iteration takes a selectively damped least squares step with backtracking:
+        the step is halved until the combined error decreases (down to min_step_scale). The
+        damping is doubled when no step is accepted and relaxed back towards
+        self.damping after a successful one. A single step never moves a joint
+        by more than max_joint_step (rad), and each singular direction is
+        bounded further near a singularity.
+        
+        With warm_start, a solve whose target and seed are both close to the last
+        converged solve starts from that solution instead of the given seed.
+        """
+        current_joints = np.array(current_joint_positions, dtype=float)
+        target_pos = np.asarray(target_pos, dtype=float)
+        target_orn = tuple(float(q) for q in target_orn)
+        
+        if warm_start and self._last_q is not None and len(self._last_q) == len(current_joints):
+            last_pos, last_orn = self._last_target
+            if (np.linalg.norm(target_pos - last_pos) < self.WARM_START_POS_TOL
+                    and np.linalg.norm(_quat_err(last_orn, target_orn)) < self.WARM_START_ORN_TOL
+                    and np.max(np.abs(current_joints - self._last_q)) < self.WARM_START_JOINT_TOL):
+                current_joints = self._last_q.copy()
+
+        lower_limits = self.JOINT_LOWER_LIMITS
+        upper_limits = self.JOINT_UPPER_LIMITS
         
         # If using shadow client, set initial joint positions in shadow robot
         if self.use_shadow_client:
-            for i, joint_idx in enumerate(self.joint_indices):
-                p.resetJointState(self.shadow_robot_id, joint_idx, current_joints[i], 
-                                 physicsClientId=self.shadow_client_id)
+            self._apply_joint_positions(current_joints)
+        
+        damping = self.damping
+        pos_error, orn_error, error = self._pose_error(target_pos, target_orn)
         
         for iter in range(max_iters):
-            # Use shadow client for calculations if available
-            current_pos, current_orn = self.get_current_ee_pose(use_shadow=self.use_shadow_client)
-            
-            pos_error = target_pos - current_pos
             pos_error_norm = np.linalg.norm(pos_error)
-            
-            client_id = self.shadow_client_id if self.use_shadow_client else 0
-            orn_error = np.array(p.getDifferenceQuaternion(current_orn.tolist(), target_orn, 
-                                                          physicsClientId=client_id)[:3])
             orn_error_norm = np.linalg.norm(orn_error)
-            
-            # combine position and orientation error
-            error = np.concatenate([pos_error, orn_error])
-            print(f"Iteration {iter}, Position Error: {pos_error_norm:.6f}, Orientation Error: {orn_error_norm:.6f}")
+            if self.verbose:
+                print(f"Iteration {iter}, Position Error: {pos_error_norm:.6f}, Orientation Error: {orn_error_norm:.6f}")
             
             if pos_error_norm < tolerance and orn_error_norm < tolerance:
-                print("IK solved successfully!")
+                if self.verbose:
+                    print("IK solved successfully!")
+                self._last_q = current_joints.copy()
+                self._last_target = (target_pos.copy(), target_orn)
                 break
             
             J = self.get_jacobian(current_joints, use_shadow=self.use_shadow_client)
             
-            # damped least squares
-            delta_q = np.linalg.solve(
-                J.T @ J + self.damping * np.eye(self.num_joints),
-                J.T @ error
-            )
+            # selectively damped least squares
+            delta_q = _dls_step(J, error, damping, max_step=max_joint_step)
+            if np.linalg.norm(delta_q) < min_delta_norm:
+                if self.verbose:
+                    print("IK step below threshold, stopping")
+                break
             
-            # update joint angles, and check joint limits
-            new_joints = current_joints + delta_q
+            # backtracking line search on the step length
+            error_norm = np.linalg.norm(error)
+            accepted = False
+            alpha = 1.0
+            while alpha >= min_step_scale:
+                step_joints = current_joints + alpha * delta_q
+                new_joints = np.clip(step_joints, lower_limits, upper_limits)
+                
+                self._apply_joint_positions(new_joints)
+                new_pos_error, new_orn_error, new_error = self._pose_error(target_pos, target_orn)
+                if np.linalg.norm(new_error) < error_norm:
+                    accepted = True
+                    break
+                alpha *= 0.5
             
-            # apply joint limits
-            for i in range(min(len(new_joints), len(joint_limits))):
-                lower_limit, upper_limit = joint_limits[i]
-                if new_joints[i] < lower_limit:
-                    new_joints[i] = lower_limit
-                    print(f"Warning: Joint {i+1} exceeds lower limit, truncated to {lower_limit}")
-                elif new_joints[i] > upper_limit:
-                    new_joints[i] = upper_limit
-                    print(f"Warning: Joint {i+1} exceeds upper limit, truncated to {upper_limit}")
+            if not accepted:
+                # no step reduced the error: restore the joints and increase damping
+                self._apply_joint_positions(current_joints)
+                damping *= 2.0
+                continue
+            
+            # report joints truncated at their limits
+            if self.verbose:
+                for i in np.nonzero(step_joints < lower_limits)[0]:
+                    print(f"Warning: Joint {i+1} exceeds lower limit, truncated to {lower_limits[i]}")
+                for i in np.nonzero(step_joints > upper_limits)[0]:
+                    print(f"Warning: Joint {i+1} exceeds upper limit, truncated to {upper_limits[i]}")
             
             # update joint angles
             current_joints = new_joints
-            
-            # set joint state in shadow client only during iterations
-            if self.use_shadow_client:
-                for i, joint_idx in enumerate(self.joint_indices):
-                    p.resetJointState(self.shadow_robot_id, joint_idx, current_joints[i], 
-                                     physicsClientId=self.shadow_client_id)
-            else:
-                for i, joint_idx in enumerate(self.joint_indices):
-                    p.resetJointState(self.robot_id, joint_idx, current_joints[i])
+            pos_error, orn_error, error = new_pos_error, new_orn_error, new_error
+            damping = max(damping * 0.5, self.damping)
                 
         return current_joints.tolist()
     
@@ -2,9 +2,48 @@ import numpy as np
 import pybullet as p
 import cv2
 
+from src.utils import njit, NUMBA_AVAILABLE
+
+
+@njit(cache=True)
+def _mask_bounds(seg, obstacle_ids):
+    """Pixel count and bounding box (y0, y1, x0, x1; end exclusive) of each ID in one pass over seg."""
+    height, width = seg.shape
+    n = obstacle_ids.shape[0]
+    counts = np.zeros(n, dtype=np.int64)
+    bounds = np.empty((n, 4), dtype=np.int64)
+    for k in range(n):
+        bounds[k, 0] = height
+        bounds[k, 1] = 0
+        bounds[k, 2] = width
+        bounds[k, 3] = 0
+    for y in range(height):
+        for x in range(width):
+            value = seg[y, x]
+            for k in range(n):
+                if value == obstacle_ids[k]:
+                    counts[k] += 1
+                    bounds[k, 0] = min(bounds[k, 0], y)
+                    bounds[k, 1] = max(bounds[k, 1], y + 1)
+                    bounds[k, 2] = min(bounds[k, 2], x)
+                    bounds[k, 3] = max(bounds[k, 3], x + 1)
+                    break
+    return counts, bounds
+
 
 
 class ObstacleTracker:
+    # corner offsets (in units of the half size) and the 12 edges of a tracking box
+    CORNER_SIGNS = np.array([
+        [-1, -1, -1], [1, -1, -1], [1, 1, -1], [-1, 1, -1],
+        [-1, -1, 1], [1, -1, 1], [1, 1, 1], [-1, 1, 1]
+    ], dtype=float)
+    EDGES = [
+        (0, 1), (1, 2), (2, 3), (3, 0),  # 4 bottom edges
+        (4, 5), (5, 6), (6, 7), (7, 4),  # 4 top edges
+        (0, 4), (1, 5), (2, 6), (3, 7)   # 4 vertical edges
+    ]
+
     def __init__(self, n_obstacles=2, exp_settings=None):
         """
         Args:
@@ -18,7 +57,29 @@ class ObstacleTracker:
         self.n_obstacles = n_obstacles
         # Store latest measurements
         self.latest_positions = np.zeros((n_obstacles, 3))
-        self.latest_radius = [0.0 for _ in range(n_obstacles)]
+        self.latest_radius = np.zeros(n_obstacles)
+        # debug line IDs of the tracking boxes, updated in place on later calls
+        self._debug_line_ids = []
+        
+        # the static camera never moves, so its intrinsics and extrinsics are fixed
+        width = self.camera_settings["width"]
+        height = self.camera_settings["height"]
+        fov = self.camera_settings["fov"] # conventionally defined in the direction of height
+        self._inv_w = 1.0 / width
+        self._inv_h = 1.0 / height
+        self._tan_half_fov = np.tan(np.deg2rad(fov / 2))
+        self._aspect_tan = (width / height) * self._tan_half_fov
+        
+        # camera space basis
+        self._cam_pos = np.array(self.camera_settings["stat_cam_pos"], dtype=float)
+        target_pos = np.array(self.camera_settings["stat_cam_target_pos"], dtype=float)
+        forward = target_pos - self._cam_pos
+        forward = forward / np.linalg.norm(forward)
+        right = np.cross(forward, np.array([0, 0, 1]))
+        right = right / np.linalg.norm(right)
+        up = np.cross(right, forward)
+        up = up / np.linalg.norm(up)
+        self._R = np.column_stack([right, up, forward])
         
 
     def convert_depth_to_meters(self, depth_buffer):
@@ -41,41 +102,19 @@ class ObstacleTracker:
         Returns:
             world_point: 3D coordinates in world space
         """
-        width = self.camera_settings["width"]
-        height = self.camera_settings["height"]
-        fov = self.camera_settings["fov"] # conventionally defined in the direction of height
-        
-        # 1. Get camera parameters
-        cam_pos = np.array(self.camera_settings["stat_cam_pos"])
-        target_pos = np.array(self.camera_settings["stat_cam_target_pos"])
+        # pixel to NDC to camera space
+        cam_point = np.array([
+            (2.0 * pixel_x * self._inv_w - 1.0) * self._aspect_tan * depth,
+            -(2.0 * pixel_y * self._inv_h - 1.0) * self._tan_half_fov * depth,
+            depth
+        ])
         
-        # 2. Pixel to NDC (Normalized Device Coordinates)
-        ndc_x = (2.0 * pixel_x - width) / width
-        ndc_y = -(2.0 * pixel_y - height) / height
-        
-        # 3. NDC to camera space
-        aspect = width / height
-        tan_half_fov = np.tan(np.deg2rad(fov / 2))
-        cam_x = ndc_x * aspect * tan_half_fov * depth
-        cam_y = ndc_y * tan_half_fov * depth
-        cam_z = depth
-        
-        # 4. Create camera space basis
-        forward = target_pos - cam_pos
-        forward = forward / np.linalg.norm(forward)
-        right = np.cross(forward, np.array([0, 0, 1]))
-        right = right / np.linalg.norm(right)
-        up = np.cross(right, forward)
-        up = up / np.linalg.norm(up)
-        
-        # 5. Camera space to world space
-        R = np.column_stack([right, up, forward])
-        cam_point = np.array([cam_x, cam_y, cam_z])
-        surface_point = cam_pos + R @ cam_point
+        # camera space to world space
+        surface_point = self._cam_pos + self._R @ cam_point
         
         if radius > 0:
             # Calculate direction from camera to surface point
-            direction = surface_point - cam_pos
+            direction = surface_point - self._cam_pos
             direction = direction / np.linalg.norm(direction)
             
             # Offset the surface point by radius along this direction
@@ -84,138 +123,164 @@ class ObstacleTracker:
         else:
             return surface_point
     
+    def pixels_to_world(self, pixel_x, pixel_y, depth, radius=0):
+        """
+        Vectorized pixel_to_world for N pixels.
+        
+        Args:
+            pixel_x: (N,) x coordinates in image space
+            pixel_y: (N,) y coordinates in image space
+            depth: (N,) metric depth values
+            radius: scalar or (N,) sphere radii (to adjust from surface to center)
+        
+        Returns:
+            world_points: (N, 3) coordinates in world space
+        """
+        pixel_x = np.asarray(pixel_x, dtype=float)
+        pixel_y = np.asarray(pixel_y, dtype=float)
+        depth = np.asarray(depth, dtype=float)
+        
+        cam_points = np.stack([
+            (2.0 * pixel_x * self._inv_w - 1.0) * self._aspect_tan * depth,
+            -(2.0 * pixel_y * self._inv_h - 1.0) * self._tan_half_fov * depth,
+            depth
+        ], axis=1)
+        surface_points = self._cam_pos[None, :] + cam_points @ self._R.T
+        
+        # offset each surface point by its radius along the viewing ray
+        directions = surface_points - self._cam_pos
+        directions /= np.linalg.norm(directions, axis=1, keepdims=True)
+        radius = np.broadcast_to(np.asarray(radius, dtype=float), depth.shape)
+        return surface_points + directions * radius[:, None]
+    
     def calculate_metric_radius(self, area, depth):
         """Calculate sphere radius with corrective factor"""
-        height = self.camera_settings["height"]
-        fov_rad = np.deg2rad(self.camera_settings["fov"])
-        
         # projected pixel radius
         pixel_radius = np.sqrt(area / np.pi)
         
         # calculate base radius
-        base_radius = (pixel_radius * depth * 2 * np.tan(fov_rad/2)) / height
+        base_radius = pixel_radius * depth * 2 * self._tan_half_fov * self._inv_h
         
         
         return base_radius
     
     def detect_obstacles(self, rgb, depth, seg):
-        """Detect obstacles using fixed segmentation mask IDs (6 and 7)"""
-        detections = []
-        potential_balls = []
+        """Detect obstacles using fixed segmentation mask IDs (6 and 7)
         
+        Returns:
+            (k, 4) array of detected spheres, one row [x, y, z, radius] per obstacle found
+        """
         # fixed obstacle IDs
         obstacle_ids = [6, 7]
         # print(f"\nUsing fixed obstacle IDs: {obstacle_ids}")
         
+        # image center and contour area of every obstacle ID, filled in as they are found
+        centers = np.zeros((len(obstacle_ids), 2), dtype=np.int64)
+        areas = np.zeros(len(obstacle_ids))
+        found = np.zeros(len(obstacle_ids), dtype=bool)
+        
+        # pixel count and bounding box of every obstacle ID
+        if NUMBA_AVAILABLE:
+            counts, bounds = _mask_bounds(np.ascontiguousarray(seg), np.array(obstacle_ids, dtype=seg.dtype))
+        else:
+            counts = np.zeros(len(obstacle_ids), dtype=np.int64)
+            bounds = np.zeros((len(obstacle_ids), 4), dtype=np.int64)
+            for k, obj_id in enumerate(obstacle_ids):
+                ys, xs = np.nonzero(seg == obj_id)
+                if len(ys) > 0:
+                    counts[k] = len(ys)
+                    bounds[k] = (ys.min(), ys.max() + 1, xs.min(), xs.max() + 1)
+        
         # process fixed ID obstacles directly
-        for obj_id in obstacle_ids:
+        for k, (obj_id, count, (y0, y1, x0, x1)) in enumerate(zip(obstacle_ids, counts, bounds)):
             # check if the ID exists in the segmentation mask
-            if obj_id not in np.unique(seg):
+            if count == 0:
                 print(f"Warning: ID {obj_id} not in the current segmentation mask")
                 continue
-                
-            mask = (seg == obj_id).astype(np.uint8)
             
-            # find contours
-            contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+            # crop to the object's bounding box (with a 1 pixel margin)
+            y0, y1 = max(y0 - 1, 0), y1 + 1
+            x0, x1 = max(x0 - 1, 0), x1 + 1
+            mask = (seg[y0:y1, x0:x1] == obj_id).astype(np.uint8)
             
-            if not contours:
-                print(f"Warning: ID {obj_id} no valid contours found")
+            # connected components of the mask; label 0 is the background
+            n_labels, _, stats, centroids = cv2.connectedComponentsWithStats(mask, connectivity=8)
+            if n_labels < 2:
+                print(f"Warning: ID {obj_id} no valid components found")
                 continue
-                
-            # use the largest contour
-            contour = max(contours, key=cv2.contourArea)
-            area = cv2.contourArea(contour)
-            
-            # calculate the contour center
-            M = cv2.moments(contour)
-            if M['m00'] == 0:
-                print(f"Warning: ID {obj_id} contour area is zero")
-                continue
-                
-            cx = int(M['m10']/M['m00'])
-            cy = int(M['m01']/M['m00'])
-            
-            # check depth
-            depth_buffer = depth[cy, cx]
-            metric_depth = self.convert_depth_to_meters(depth_buffer)
-            
-            # calculate the radius
-            base_radius = self.calculate_metric_radius(area, metric_depth)
             
-            # calculate the world position of the sphere center
-            world_pos = self.pixel_to_world(cx, cy, metric_depth, radius=base_radius)
+            # use the largest component, centroid offset back to full image coordinates
+            label = 1 + np.argmax(stats[1:, cv2.CC_STAT_AREA])
+            area = stats[label, cv2.CC_STAT_AREA]
+            cx = int(centroids[label, 0]) + int(x0)
+            cy = int(centroids[label, 1]) + int(y0)
             
-            # add to the potential sphere list
-            potential_balls.append({
-                'id': obj_id,
-                'center': (cx, cy),
-                'world_pos': world_pos,
-                'depth': metric_depth,
-                'area': area,
-                'radius': base_radius
-            })
-
-        # directly use all detected spheres
-        for ball in potential_balls:
-            detections.append(np.array([
-                ball['world_pos'][0], 
-                ball['world_pos'][1], 
-                ball['world_pos'][2], 
-                ball['radius']
-            ]))
-
+            centers[k] = (cx, cy)
+            areas[k] = area
+            found[k] = True
+        
+        if not found.any():
+            return np.empty((0, 4))
+        centers = centers[found]
+        areas = areas[found]
+        
+        # depth, radius and world position of all spheres at once
+        metric_depths = self.convert_depth_to_meters(depth[centers[:, 1], centers[:, 0]])
+        base_radii = self.calculate_metric_radius(areas, metric_depths)
+        
+        detections = np.empty((len(areas), 4))
+        detections[:, :3] = self.pixels_to_world(centers[:, 0], centers[:, 1], metric_depths, radius=base_radii)
+        detections[:, 3] = base_radii
         return detections
     
     def update(self, detections):
-        """Update tracking with new detections."""
-        for i, detection in enumerate(detections):
-            if i < self.n_obstacles:
-                self.latest_positions[i] = detection[:3]  # set initial position
-                self.latest_radius[i] = detection[3]     # store radius separately
+        """Update tracking with new detections ((k, 4) array of [x, y, z, radius] rows)."""
+        detections = np.asarray(detections).reshape(-1, 4)
+        k = min(len(detections), self.n_obstacles)
+        self.latest_positions[:k] = detections[:k, :3]  # set initial position
+        self.latest_radius[:k] = detections[:k, 3]      # store radius separately
         return self.latest_positions
 
           
     # 3d bounding box
     def visualize_tracking_3d(self, tracked_positions):
-        """Visualize tracking boxes in 3D space"""
-        debug_ids = []
+        """Visualize tracking boxes in 3D space
+        
+        The box edges created by the first call are kept and moved in place via
+        replaceItemUniqueId on subsequent calls.
+        
+        Args:
+            tracked_positions: Positions of the tracked obstacles
+        
+        Returns:
+            List of debug line IDs
+        """
+        new_debug_ids = []
         
         for i, pos in enumerate(tracked_positions):
             # access the estimated radius
             half_size = self.latest_radius[i]
             
             # 8 corners of the bounding box
-            corners = [
-                [pos[0]-half_size, pos[1]-half_size, pos[2]-half_size],
-                [pos[0]+half_size, pos[1]-half_size, pos[2]-half_size],
-                [pos[0]+half_size, pos[1]+half_size, pos[2]-half_size],
-                [pos[0]-half_size, pos[1]+half_size, pos[2]-half_size],
-                [pos[0]-half_size, pos[1]-half_size, pos[2]+half_size],
-                [pos[0]+half_size, pos[1]-half_size, pos[2]+half_size],
-                [pos[0]+half_size, pos[1]+half_size, pos[2]+half_size],
-                [pos[0]-half_size, pos[1]+half_size, pos[2]+half_size]
-            ]
-            
-            # 4 bottom edges
-            debug_ids.append(p.addUserDebugLine(corners[0], corners[1], [0, 1, 0]))
-            debug_ids.append(p.addUserDebugLine(corners[1], corners[2], [0, 1, 0]))
-            debug_ids.append(p.addUserDebugLine(corners[2], corners[3], [0, 1, 0]))
-            debug_ids.append(p.addUserDebugLine(corners[3], corners[0], [0, 1, 0]))
+            corners = (np.asarray(pos[:3], dtype=float) + half_size * self.CORNER_SIGNS).tolist()
             
-            # 4 top edges
-            debug_ids.append(p.addUserDebugLine(corners[4], corners[5], [0, 1, 0]))
-            debug_ids.append(p.addUserDebugLine(corners[5], corners[6], [0, 1, 0]))
-            debug_ids.append(p.addUserDebugLine(corners[6], corners[7], [0, 1, 0]))
-            debug_ids.append(p.addUserDebugLine(corners[7], corners[4], [0, 1, 0]))
-            
-            # 4 vertical edges
-            debug_ids.append(p.addUserDebugLine(corners[0], corners[4], [0, 1, 0]))
-            debug_ids.append(p.addUserDebugLine(corners[1], corners[5], [0, 1, 0]))
-            debug_ids.append(p.addUserDebugLine(corners[2], corners[6], [0, 1, 0]))
-            debug_ids.append(p.addUserDebugLine(corners[3], corners[7], [0, 1, 0]))
+            for start, end in self.EDGES:
+                k = len(new_debug_ids)
+                line_id = -1
+                if k < len(self._debug_line_ids):
+                    line_id = p.addUserDebugLine(corners[start], corners[end], [0, 1, 0],
+                                                 replaceItemUniqueId=self._debug_line_ids[k])
+                if line_id < 0:
+                    # no previous line, or it was removed externally
+                    line_id = p.addUserDebugLine(corners[start], corners[end], [0, 1, 0])
+                new_debug_ids.append(line_id)
+        
+        # drop lines left over from a call with more obstacles
+        for line_id in self._debug_line_ids[len(new_debug_ids):]:
+            p.removeUserDebugItem(line_id)
         
-        return debug_ids
+        self._debug_line_ids = new_debug_ids
+        return new_debug_ids
     
     def get_obstacle_state(self, obstacle_index):
         """Get full state estimate for an obstacle.
@@ -256,16 +321,7 @@ class ObstacleTracker:
         Returns:
             bool: True if both conditions are met, otherwise False
         """
-        # ensure we have enough spheres
-        if self.n_obstacles < 2:
-            return False
-            
-        # get the sphere positions
-        ball1_pos = self.latest_positions[0]
-        ball2_pos = self.latest_positions[1]
-        # check conditions
-        ball1_away = ball1_pos[0] < 0.03  # ball1's y coordinate is less than 0.03
-        ball2_away = ball2_pos[1] < 0.03  # ball2's x coordinate is less than 0.03
-        
-        # return True if both conditions are met
-        return ball1_away and ball2_away
\ No newline at end of file
+        # ensure we have enough spheres, then compare the two coordinates in place
+        return (self.n_obstacles >= 2
+                and self.latest_positions[0, 0] < 0.03
+                and self.latest_positions[1, 1] < 0.03)
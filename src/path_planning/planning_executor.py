@@ -1,6 +1,7 @@
 import numpy as np
 import pybullet as p
 import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import Any, Dict
 
 from src.path_planning.rrt_star import RRTStarPlanner
@@ -31,6 +32,10 @@ class PlanningExecutor:
         self.robot = sim.robot
         self.obstacle_tracker = ObstacleTracker(n_obstacles=2, exp_settings=config)
         
+        # Obstacle detection runs on a worker thread while the simulation keeps stepping
+        self._perception_pool = ThreadPoolExecutor(max_workers=1)
+        self._pending_detection = None
+        
         # Initialize IK solver
         self.ik_solver = DifferentialIKSolver(
             self.robot.id, 
@@ -109,9 +114,7 @@ class PlanningExecutor:
 
             ball_is_far = False
             while(not ball_is_far):
-                rgb_static, depth_static, seg_static = self.sim.get_static_renders()
-                detections = self.obstacle_tracker.detect_obstacles(rgb_static, depth_static, seg_static)
-                tracked_positions = self.obstacle_tracker.update(detections)
+                tracked_positions = self._perceive_obstacles()
                 ball_is_far = self.obstacle_tracker.is_away()
                 for _ in range(1):
                     self.sim.step()
@@ -196,9 +199,7 @@ class PlanningExecutor:
                 
                 while not goal_reached:
                     # update obstacle positions
-                    rgb_static, depth_static, seg_static = self.sim.get_static_renders()
-                    detections = self.obstacle_tracker.detect_obstacles(rgb_static, depth_static, seg_static)
-                    tracked_positions = self.obstacle_tracker.update(detections)
+                    tracked_positions = self._perceive_obstacles()
                     
                     # # visualize obstacle bounding boxes
                     # if visualize:
@@ -232,8 +233,8 @@ class PlanningExecutor:
                     # execute a part of the trajectory, then replan
                     for joint_pos in subpath:
                         # set joint position
-                        for i, idx in enumerate(joint_indices):
-                            p.setJointMotorControl2(self.robot.id, idx, p.POSITION_CONTROL, joint_pos[i])
+                        p.setJointMotorControlArray(self.robot.id, jointIndices=joint_indices,
+                                                    controlMode=p.POSITION_CONTROL, targetPositions=joint_pos)
                         
                         # execute multiple simulation steps
                         for _ in range(steps):
@@ -260,9 +261,7 @@ class PlanningExecutor:
             else:
                 # without dynamic replanning
                 # Use static camera to get obstacle positions
-                rgb_static, depth_static, seg_static = self.sim.get_static_renders()
-                detections = self.obstacle_tracker.detect_obstacles(rgb_static, depth_static, seg_static)
-                tracked_positions = self.obstacle_tracker.update(detections)
+                tracked_positions = self._perceive_obstacles(sync=True)
                 
                 # Visualize obstacle bounding boxes (if needed)
                 if visualize:
@@ -409,9 +408,7 @@ class PlanningExecutor:
 
             while not goal_reached:
                 # Get current environment image and update obstacles
-                rgb_static, depth_static, seg_static = self.sim.get_static_renders()
-                detections = self.obstacle_tracker.detect_obstacles(rgb_static, depth_static, seg_static)
-                tracked_positions = self.obstacle_tracker.update(detections)
+                tracked_positions = self._perceive_obstacles()
 
                 # Use potential field method to replan, considering global path attractive force
                 print("\nUse potential field method to local obstacle avoidance planning...")
@@ -423,8 +420,8 @@ class PlanningExecutor:
                 joint_indices = self.robot.arm_idx
 
                 # Set joint position
-                for i, idx in enumerate(joint_indices):
-                    p.setJointMotorControl2(self.robot.id, idx, p.POSITION_CONTROL, next_joint_pos[i])
+                p.setJointMotorControlArray(self.robot.id, jointIndices=joint_indices,
+                                            controlMode=p.POSITION_CONTROL, targetPositions=next_joint_pos)
 
                 # Execute several simulation steps
                 for _ in range(steps):
@@ -446,9 +443,7 @@ class PlanningExecutor:
 
             ball_is_far = False
             while(not ball_is_far):
-                rgb_static, depth_static, seg_static = self.sim.get_static_renders()
-                detections = self.obstacle_tracker.detect_obstacles(rgb_static, depth_static, seg_static)
-                tracked_positions = self.obstacle_tracker.update(detections)
+                tracked_positions = self._perceive_obstacles()
                 ball_is_far = self.obstacle_tracker.is_away()
                 for _ in range(1):
                     self.sim.step()
@@ -520,9 +515,7 @@ class PlanningExecutor:
             )
             
             # Get obstacle positions using static camera
-            rgb_static, depth_static, seg_static = self.sim.get_static_renders()
-            detections = self.obstacle_tracker.detect_obstacles(rgb_static, depth_static, seg_static)
-            tracked_positions = self.obstacle_tracker.update(detections)
+            tracked_positions = self._perceive_obstacles(sync=True)
             
             # Visualize obstacle bounding boxes
             if visualize:
@@ -576,9 +569,7 @@ class PlanningExecutor:
             
             while not goal_reached:
                 # Get current environment and update obstacles
-                rgb_static, depth_static, seg_static = self.sim.get_static_renders()
-                detections = self.obstacle_tracker.detect_obstacles(rgb_static, depth_static, seg_static)
-                tracked_positions = self.obstacle_tracker.update(detections)
+                tracked_positions = self._perceive_obstacles()
                 
                 # Use potential field method to replan, considering global path attractive force
                 print("\nUse potential field method to local obstacle avoidance planning...")
@@ -590,8 +581,8 @@ class PlanningExecutor:
                 joint_indices = self.robot.arm_idx
                 
                 # Set joint position
-                for i, idx in enumerate(joint_indices):
-                    p.setJointMotorControl2(self.robot.id, idx, p.POSITION_CONTROL, next_joint_pos[i])
+                p.setJointMotorControlArray(self.robot.id, jointIndices=joint_indices,
+                                            controlMode=p.POSITION_CONTROL, targetPositions=next_joint_pos)
                 
                 # Execute simulation steps
                 for _ in range(steps):
@@ -612,9 +603,7 @@ class PlanningExecutor:
 
             ball_is_far = False
             while(not ball_is_far):
-                rgb_static, depth_static, seg_static = self.sim.get_static_renders()
-                detections = self.obstacle_tracker.detect_obstacles(rgb_static, depth_static, seg_static)
-                tracked_positions = self.obstacle_tracker.update(detections)
+                tracked_positions = self._perceive_obstacles()
                 ball_is_far = self.obstacle_tracker.is_away()
                 for _ in range(1):
                     self.sim.step()
@@ -640,6 +629,48 @@ class PlanningExecutor:
 
         return True
     
+    def _perceive_obstacles(self, sync=False):
+        """Render the static camera and update the obstacle tracker (double-buffered)
+        
+        The render stays on the calling thread because the PyBullet client is not
+        thread-safe; only the detection on the returned images is handed to the worker.
+        The tracker is updated with the previous frame's detections, so the estimate
+        lags by one control tick while detection overlaps with the next simulation steps.
+        
+        Parameters:
+        sync: Detect on the current frame and drop any buffered detection, for one-shot
+            calls (e.g. before planning) where the buffered frame may be many steps old
+        
+        Returns:
+        tracked_positions: Latest tracked obstacle positions
+        """
+        rgb_static, depth_static, seg_static = self.sim.get_static_renders()
+        
+        if sync:
+            # wait for the worker so the tracker is not used from two threads at once
+            if self._pending_detection is not None:
+                self._pending_detection.result()
+                self._pending_detection = None
+            detections = self.obstacle_tracker.detect_obstacles(rgb_static, depth_static, seg_static)
+            return self.obstacle_tracker.update(detections)
+        
+        if self._pending_detection is None:
+            # first frame: nothing buffered yet, detect synchronously
+            detections = self.obstacle_tracker.detect_obstacles(rgb_static, depth_static, seg_static)
+        else:
+            detections = self._pending_detection.result()
+        tracked_positions = self.obstacle_tracker.update(detections)
+        
+        self._pending_detection = self._perception_pool.submit(
+            self.obstacle_tracker.detect_obstacles, rgb_static, depth_static, seg_static)
+        
+        return tracked_positions
+    
+    def close(self):
+        """Wait for any buffered detection and shut down the perception worker"""
+        self._perception_pool.shutdown(wait=True)
+        self._pending_detection = None
+    
     def _visualize_goal_position(self, goal_pos):
         """Visualize target position"""        
         # Add coordinate axes at target position
@@ -692,8 +723,8 @@ class PlanningExecutor:
         """
         for joint_pos in trajectory:
             # Set joint positions
-            for i, idx in enumerate(joint_indices):
-                p.setJointMotorControl2(self.robot.id, idx, p.POSITION_CONTROL, joint_pos[i])
+            p.setJointMotorControlArray(self.robot.id, jointIndices=joint_indices,
+                                        controlMode=p.POSITION_CONTROL, targetPositions=joint_pos)
             
             # Run multiple simulation steps for each trajectory point
             for _ in range(steps):
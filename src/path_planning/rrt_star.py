@@ -1,14 +1,49 @@
+import itertools
+import math
+from collections import deque
+from functools import lru_cache
+
 import numpy as np
 import pybullet as p
-import random
 
-from scipy.spatial import KDTree
-from typing import List, Tuple
+from typing import Dict, List, Tuple, Optional
 
 from src.robot import Robot
 from src.obstacle_tracker.obstacle_tracker import ObstacleTracker
+from src.utils import njit, NUMBA_AVAILABLE
+
+
+@njit(cache=True, fastmath=True)
+def _nearest_idx(nodes, n, q):
+    """Index of the node (among the first n rows of nodes) closest to q."""
+    best_idx = 0
+    best_d2 = np.inf
+    for i in range(n):
+        d2 = 0.0
+        for j in range(q.shape[0]):
+            diff = nodes[i, j] - q[j]
+            d2 += diff * diff
+        if d2 < best_d2:
+            best_d2 = d2
+            best_idx = i
+    return best_idx
 
 
+@njit(cache=True, fastmath=True)
+def _nearby_idx(nodes, n, q, r2):
+    """Indices of the nodes (among the first n rows of nodes) within squared distance r2 of q."""
+    out = np.empty(n, dtype=np.int64)
+    k = 0
+    for i in range(n):
+        d2 = 0.0
+        for j in range(q.shape[0]):
+            diff = nodes[i, j] - q[j]
+            d2 += diff * diff
+        if d2 <= r2:
+            out[k] = i
+            k += 1
+    return out[:k]
+
 
 class RRTStarPlanner:
     """RRT* path planning algorithm for robotic arm.
@@ -19,12 +54,35 @@ class RRTStarPlanner:
         robot: Instance of Robot class
         obstacle_tracker: Instance of ObstacleTracker to get obstacle positions
         max_iterations: Maximum number of RRT* iterations
-        step_size: Maximum step size for extending the tree
+        step_size: Base step size for extending the tree
         goal_sample_rate: Probability of sampling the goal
         search_radius: Radius for rewiring in RRT*
         goal_threshold: Distance threshold to consider goal reached (joint space)
         collision_check_step: Step size for collision checking along the path
+        seed: Seed for the planner's random generator (None for a random seed)
+        bidirectional: Grow a second tree from the goal and connect the two (RRT*-Connect)
+        visualize: Draw the tree while planning; ignored (off) unless connected in GUI mode
+        adaptive_step: Grow the step with the recent extension success rate (off: fixed step_size)
+        step_extend_d: Step size growth with adaptive_step; the step is
+            step_size * (1 + step_extend_d * success_rate), clamped to [step_size, 3 * step_size]
+        refine_iterations: Iterations to keep improving the path after the goal is first reached,
+            sampling inside the informed ellipsoid of the best path (0 returns the first solution)
     """
+    # Number of joints the spatial hash buckets on (the ones with the widest limit range)
+    BUCKET_DIMS = 3
+    # Below this tree size a contiguous scan of all nodes beats the bucket lookup
+    BUCKET_MIN_NODES = 1024
+    # At most this many of the closest nodes within search_radius are used for choose-parent/rewire
+    KNN_REWIRE_CAP = 32
+    # Joint values are quantized to this resolution (rad) for the collision cache
+    COLLISION_CACHE_RESOLUTION = 1e-4
+    # Fraction of samples drawn from the informed ellipsoid once a solution exists
+    INFORMED_SAMPLE_RATE = 0.9
+    # Attributes that make up one search tree; the bidirectional planner keeps a
+    # second set in _other_tree and swaps them in and out
+    TREE_ATTRS = ('_nodes_arr', '_costs_arr', '_parents_arr', '_ee_arr', '_n',
+                  '_buckets', '_debug_by_node', '_edge_free_cache')
+    
     def __init__(
         self,
         robot: Robot,
@@ -34,24 +92,105 @@ class RRTStarPlanner:
         goal_sample_rate: float = 0.05,
         search_radius: float = 0.5,
         goal_threshold: float = 0.1,
-        collision_check_step: float = 0.05
+        collision_check_step: float = 0.05,
+        seed: Optional[int] = None,
+        bidirectional: bool = False,
+        visualize: bool = True,
+        adaptive_step: bool = False,
+        step_extend_d: float = 0.5,
+        refine_iterations: int = 0
     ):
         self.robot = robot
         self.obstacle_tracker = obstacle_tracker
         self.max_iterations = max_iterations
         self.step_size = step_size
+        self.adaptive_step = adaptive_step
+        self.step_extend_d = step_extend_d
+        self._succ = deque(maxlen=50)  # outcome of the most recent tree extensions
+        self.refine_iterations = refine_iterations
         self.goal_sample_rate = goal_sample_rate
         self.search_radius = search_radius
         self.goal_threshold = goal_threshold
         self.collision_check_step = collision_check_step
+        self.bidirectional = bidirectional
         
         self.dimension = len(robot.arm_idx)
-        self.nodes = []  # List of nodes in the tree
-        self.costs = []  # Cost from start to each node
-        self.parents = []  # Parent index for each node
         
-        # Visualization
-        self.debug_lines = []
+        # one PCG64 generator for all sampling; joint samples are drawn in blocks
+        self._rng = np.random.default_rng(seed)
+        self._lo = np.asarray(robot.lower_limits, dtype=np.float64)
+        self._hi = np.asarray(robot.upper_limits, dtype=np.float64)
+        self._sample_buf = np.empty((0, self.dimension))
+        self._sample_idx = 0
+        
+        # Informed sampling (Gammell et al.): once a path of cost c_best is known, samples that
+        # can improve it lie in the hyperspheroid with foci start/goal and transverse axis c_best
+        self._c_best = np.inf
+        self._c_min = 0.0
+        self._informed_center = np.zeros(self.dimension)
+        self._informed_C = np.eye(self.dimension)
+        
+        # Tree storage as preallocated structure-of-arrays; the first _n rows are in use
+        # and the buffers are grown by doubling like a C++ vector
+        self._alloc_tree_buffers(max(max_iterations, 1) + 2)
+        self._other_tree = None  # second tree of the bidirectional planner
+        
+        # Fixed-grid spatial hash over the joint space for radius queries. Only the
+        # BUCKET_DIMS joints with the widest range are binned; uniform samples have
+        # the largest variance along those, the remaining joints are brute-forced
+        # within the candidate bins.
+        self.IYSTEP = search_radius
+        self._bucket_dims = np.argsort(self._hi - self._lo)[::-1][:min(self.BUCKET_DIMS, self.dimension)]
+        self._bucket_offsets = np.array(list(itertools.product((-1, 0, 1), repeat=len(self._bucket_dims))))
+        self._buckets: Dict[Tuple[int, ...], List[int]] = {}
+        
+        # Arm configuration currently set in the simulator by the planner, and the one
+        # to restore afterwards; joints are only reset when their value changes
+        self._current_sim_config = None
+        self._saved_sim_config = None
+        self._planning = False
+        
+        # Validity of edges between tree nodes, keyed by frozenset of the two node indices
+        self._edge_free_cache = {}
+        
+        # Per-instance memo of single-configuration checks on quantized joint values;
+        # obstacles move between queries, so it is cleared at the start of every plan()
+        self._collision_free_quantized = lru_cache(maxsize=4096)(self._collision_free_quantized_uncached)
+        
+        # Visualization: debug line id of the edge into each node, keyed by node index.
+        # Debug items are invisible without a GUI, so skip them (and the end-effector FK) there
+        self._viz = visualize and p.getConnectionInfo()['connectionMethod'] == p.GUI
+        self._debug_by_node: Dict[int, int] = {}
+        
+    def _alloc_tree_buffers(self, capacity: int) -> None:
+        """Allocate empty node buffers for the active tree."""
+        self._nodes_arr = np.empty((capacity, self.dimension))  # Joint configuration of each node
+        self._costs_arr = np.empty(capacity)  # Cost from the root to each node
+        self._parents_arr = np.empty(capacity, dtype=np.int32)  # Parent index for each node
+        self._ee_arr = np.empty((capacity, 3))  # End-effector position for drawing, computed once on insertion
+        self._n = 0
+    
+    def _swap_trees(self) -> None:
+        """Exchange the active tree with the other tree of the bidirectional planner."""
+        for name in self.TREE_ATTRS:
+            active = getattr(self, name)
+            setattr(self, name, self._other_tree[name])
+            self._other_tree[name] = active
+        
+    @property
+    def nodes(self) -> np.ndarray:
+        """Joint configurations of the nodes in the tree, shape (n, dimension)."""
+        return self._nodes_arr[:self._n]
+    
+    @property
+    def costs(self) -> np.ndarray:
+        """Cost from start to each node in the tree."""
+        return self._costs_arr[:self._n]
+    
+    @property
+    def parents(self) -> np.ndarray:
+        """Parent index for each node in the tree (-1 for the root)."""
+        return self._parents_arr[:self._n]
         
     def _get_current_ee_pose(self, joint_positions: List[float]) -> Tuple[np.ndarray, np.ndarray]:
         """Get end-effector pose for given joint positions.
@@ -62,31 +201,54 @@ class RRTStarPlanner:
         Returns:
             Tuple of end-effector position and orientation
         """
-        # Save current state
-        current_states = []
-        for i in self.robot.arm_idx:
-            current_states.append(p.getJointState(self.robot.id, i)[0])
-            
-        # Set joint positions
-        for i, idx in enumerate(self.robot.arm_idx):
-            p.resetJointState(self.robot.id, idx, joint_positions[i])
+        self._set_joints(joint_positions)
             
         # Get EE pose
         ee_state = p.getLinkState(self.robot.id, self.robot.ee_idx)
         ee_pos = np.array(ee_state[0])
         ee_orn = np.array(ee_state[1])
         
-        # Restore original state
-        for i, idx in enumerate(self.robot.arm_idx):
-            p.resetJointState(self.robot.id, idx, current_states[i])
+        self._release_joints()
             
         return ee_pos, ee_orn
     
+    def _set_joints(self, config: List[float]) -> None:
+        """Move the arm to config, resetting only the joints whose value changed.
+        
+        The configuration the arm had before the first move is remembered so that
+        _restore_joints can put it back.
+        """
+        if self._current_sim_config is None:
+            self._current_sim_config = np.array(
+                [state[0] for state in p.getJointStates(self.robot.id, self.robot.arm_idx)])
+            self._saved_sim_config = self._current_sim_config.copy()
+            
+        for i, idx in enumerate(self.robot.arm_idx):
+            if abs(config[i] - self._current_sim_config[i]) > 1e-12:
+                p.resetJointState(self.robot.id, idx, config[i])
+                self._current_sim_config[i] = config[i]
+    
+    def _restore_joints(self) -> None:
+        """Put the arm back into the configuration it had before the planner moved it."""
+        if self._saved_sim_config is not None:
+            self._set_joints(self._saved_sim_config)
+        self._current_sim_config = None
+        self._saved_sim_config = None
+    
+    def _release_joints(self) -> None:
+        """Restore the arm right away unless a plan() call is running (it restores once at the end)."""
+        if not self._planning:
+            self._restore_joints()
+    
     def clear_visualization(self) -> None:
-        """Clear visualization of tree."""
-        for _, _, debug_id in self.debug_lines:
+        """Clear visualization of tree (of both trees in bidirectional mode)."""
+        for debug_id in self._debug_by_node.values():
             p.removeUserDebugItem(debug_id)
-        self.debug_lines = []
+        self._debug_by_node = {}
+        if self._other_tree is not None:
+            for debug_id in self._other_tree['_debug_by_node'].values():
+                p.removeUserDebugItem(debug_id)
+            self._other_tree['_debug_by_node'] = {}
         
     def generate_smooth_trajectory(self, path: List[List[float]], smoothing_steps: int = 10) -> List[List[float]]:
         """Generate smooth trajectory from path.
@@ -101,19 +263,30 @@ class RRTStarPlanner:
         if not path or len(path) < 2:
             return path
             
-        # Interpolate between waypoints
-        smooth_trajectory = []
+        # Interpolate between waypoints: one (smoothing_steps + 1, dim) block per segment,
+        # endpoints included, computed for all segments at once
+        path_arr = np.asarray(path, dtype=np.float64)
+        starts = path_arr[:-1, None, :]
+        deltas = (path_arr[1:] - path_arr[:-1])[:, None, :]
+        t = (np.arange(smoothing_steps + 1) / smoothing_steps)[None, :, None]
         
-        for i in range(len(path) - 1):
-            start = path[i]
-            end = path[i + 1]
-            
-            for step in range(smoothing_steps + 1):
-                t = step / smoothing_steps
-                interpolated = [start[j] + t * (end[j] - start[j]) for j in range(len(start))]
-                smooth_trajectory.append(interpolated)
-                
-        return smooth_trajectory
+        return (starts + t * deltas).reshape(-1, path_arr.shape[1]).tolist()
+    
+    def _grow_if_needed(self) -> None:
+        """Double the capacity of the tree buffers if they are full."""
+        if self._n < len(self._nodes_arr):
+            return
+        capacity = 2 * len(self._nodes_arr)
+        for name in ('_nodes_arr', '_costs_arr', '_parents_arr', '_ee_arr'):
+            old = getattr(self, name)
+            grown = np.empty((capacity,) + old.shape[1:], dtype=old.dtype)
+            grown[:self._n] = old[:self._n]
+            setattr(self, name, grown)
+    
+    def _sq_dists(self, point: List[float]) -> np.ndarray:
+        """Squared joint-space distance from point to every node in the tree."""
+        diffs = self._nodes_arr[:self._n] - np.asarray(point)
+        return np.einsum('ij,ij->i', diffs, diffs)
     
     def _find_nearest(self, point: List[float]) -> int:
         """Find nearest node to point.
@@ -124,121 +297,205 @@ class RRTStarPlanner:
         Returns:
             Index of nearest node
         """
-        dists = [np.linalg.norm(point - node) for node in self.nodes]
-        return dists.index(min(dists))
+        if NUMBA_AVAILABLE:
+            return int(_nearest_idx(self._nodes_arr, self._n, np.asarray(point, dtype=np.float64)))
+        return int(np.argmin(self._sq_dists(point)))
+    
+    def _bucket_key(self, config: np.ndarray) -> np.ndarray:
+        """Grid cell of a configuration along the bucketed joints."""
+        return np.floor((config[self._bucket_dims] - self._lo[self._bucket_dims]) / self.IYSTEP).astype(np.int64)
     
     def _find_nearby(self, point: List[float]) -> List[int]:
-            """Find nearby nodes within search radius.
-            
-            Args:
-                point: Query point
-                
-            Returns:
-                List of indices of nearby nodes
-            """
-            # Use KDTree for efficient nearest neighbor search
-            kd_tree = KDTree(self.nodes)
-            # Query for neighbors within radius
-            indices = kd_tree.query_ball_point(point, self.search_radius)
-            return indices
-
-    def _is_state_in_collision(self, joint_pos: List[float]) -> bool:
-        """Check if a joint state is in collision with obstacles.
+        """Find nearby nodes within search radius.
+        
+        In dense regions only the KNN_REWIRE_CAP closest ones are returned, which bounds
+        the choose-parent/rewire work per iteration regardless of tree size.
         
         Args:
-            joint_pos: Joint positions to check
+            point: Query point
             
         Returns:
-            True if in collision, False otherwise
-        """       
-        # Get robot links' positions for collision checking
-        # We'll check a few key links along the robot's kinematic chain
-        links_to_check = self.robot.arm_idx + [self.robot.ee_idx]
-        
-        # Save current state
-        current_states = []
-        for i in self.robot.arm_idx:
-            current_states.append(p.getJointState(self.robot.id, i)[0])
-            
-        # Set joint positions
-        for i, idx in enumerate(self.robot.arm_idx):
-            p.resetJointState(self.robot.id, idx, joint_pos[i])
+            List of indices of nearby nodes
+        """
+        point = np.asarray(point, dtype=np.float64)
+        r2 = self.search_radius ** 2
+        if self._n >= self.BUCKET_MIN_NODES:
+            # Cells are search_radius wide, so every node within the radius lies in the
+            # query cell or one of its direct neighbours
+            candidates = []
+            for key in map(tuple, self._bucket_key(point) + self._bucket_offsets):
+                candidates.extend(self._buckets.get(key, ()))
+            if not candidates:
+                return []
+            candidates = np.array(candidates)
+            diffs = self._nodes_arr[candidates] - point
+            d2 = np.einsum('ij,ij->i', diffs, diffs)
+            in_radius = d2 <= r2
+            idx_in_r, d2 = candidates[in_radius], d2[in_radius]
+        elif NUMBA_AVAILABLE:
+            idx_in_r = _nearby_idx(self._nodes_arr, self._n, point, r2)
+            d2 = None
+        else:
+            d2 = self._sq_dists(point)
+            idx_in_r = np.nonzero(d2 <= r2)[0]
+            d2 = d2[idx_in_r]
+        
+        k = self.KNN_REWIRE_CAP
+        if idx_in_r.size > k:
+            if d2 is None:
+                diffs = self._nodes_arr[idx_in_r] - point
+                d2 = np.einsum('ij,ij->i', diffs, diffs)
+            idx_in_r = idx_in_r[np.argpartition(d2, k - 1)[:k]]
+        return idx_in_r.tolist()
+
+    def _get_obstacle_arrays(self):
+        """Obstacle centers (M, 3) and collision thresholds (M,), or None if there are no obstacles."""
+        obstacle_states = self.obstacle_tracker.get_all_obstacle_states()
+        if obstacle_states is not None:
+            obstacle_states = [obstacle for obstacle in obstacle_states if obstacle is not None]
+        if not obstacle_states:
+            return None
+        
+        obs_arr = np.array([obstacle['position'] for obstacle in obstacle_states])
+        # add a small safety margin (0.05m) to the obstacle radius
+        threshold = np.array([obstacle['radius'] for obstacle in obstacle_states]) + 0.05
+        return obs_arr, threshold
+    
+    def _get_link_positions(self, configs: List[List[float]]) -> np.ndarray:
+        """Positions of the checked links (arm joints + end effector) for each configuration.
         
-        # Check collision with obstacles    
-        collision = False
+        PyBullet has one kinematic state per client, so the configurations are set one
+        after another; each costs a single batched getLinkStates call.
         
-        # Get obstacle states from tracker
-        obstacle_states = self.obstacle_tracker.get_all_obstacle_states()
+        Returns:
+            (K, L, 3) array of link positions, the end effector last
+        """
+        links_to_check = self.robot.arm_idx + [self.robot.ee_idx]
+        links_arr = np.empty((len(configs), len(links_to_check), 3))
+        for k, config in enumerate(configs):
+            self._set_joints(config)
+            link_states = p.getLinkStates(self.robot.id, links_to_check)
+            links_arr[k] = [link_state[0] for link_state in link_states]
+        self._release_joints()
+        return links_arr
+    
+    @staticmethod
+    def _links_hit_obstacles(links_arr: np.ndarray, obs_arr: np.ndarray, threshold: np.ndarray) -> np.ndarray:
+        """Sphere collision check of K arm poses against M obstacles at once.
         
-        if obstacle_states is None or len(obstacle_states) == 0:
-            # No detection needed, restore original state
-            for i, idx in enumerate(self.robot.arm_idx):
-                p.resetJointState(self.robot.id, idx, current_states[i])
-            return False
+        The arm is approximated as the chain of segments between consecutive link origins.
         
-        # Check each link against each obstacle
-        for link_idx in links_to_check:
-            link_state = p.getLinkState(self.robot.id, link_idx)
-            link_pos = np.array(link_state[0])
-            
-            for obstacle in obstacle_states:
-                if obstacle is None:
-                    continue
-                
-                # Simple sphere collision check
-                obstacle_pos = obstacle['position']
-                obstacle_radius = obstacle['radius']
-                
-                # Distance between link and obstacle center
-                dist = np.linalg.norm(link_pos - obstacle_pos)
-                
-                # Approximate the robot link as a point (simplification)
-                # Add a small safety margin (0.05m)
-                if dist < obstacle_radius + 0.05:
-                    collision = True
-                    break
-                
-        # Restore original state
-        for i, idx in enumerate(self.robot.arm_idx):
-            p.resetJointState(self.robot.id, idx, current_states[i])
+        Args:
+            links_arr: (K, L, 3) link positions
+            obs_arr: (M, 3) obstacle centers
+            threshold: (M,) obstacle radius plus safety margin
             
-        return collision
+        Returns:
+            (K,) boolean array, True where a segment comes within threshold of an obstacle
+        """
+        # Closest point on every segment to every obstacle center
+        seg_start = links_arr[:, :-1]  # (K, S, 3)
+        seg_vec = links_arr[:, 1:] - seg_start  # (K, S, 3)
+        seg_len_sq = np.einsum('ksd,ksd->ks', seg_vec, seg_vec)
+        to_obs = obs_arr[None, None, :, :] - seg_start[:, :, None, :]  # (K, S, M, 3)
+        t = np.einsum('ksmd,ksd->ksm', to_obs, seg_vec) / np.maximum(seg_len_sq, 1e-12)[:, :, None]
+        np.clip(t, 0.0, 1.0, out=t)
+        
+        # Squared distance between every segment and every obstacle center
+        diffs = to_obs - t[..., None] * seg_vec[:, :, None, :]
+        d2 = np.einsum('ksmd,ksmd->ksm', diffs, diffs)
+        return (d2 < threshold ** 2).any(axis=(1, 2))
     
-    def _is_ee_height_valid(self, joint_pos: List[float]) -> bool:
-        """Check if end effector height is valid (above the table).
+    def _configs_collision_free(self, configs: List[List[float]]) -> np.ndarray:
+        """Batched _is_collision_free: FK for each configuration, then one vectorized test.
         
         Args:
-            joint_pos: Joint positions to check
+            configs: Joint configurations to check
             
         Returns:
-            True if end effector height is valid, False otherwise
+            (K,) boolean array, True where the configuration is collision-free
         """
-        # Get end-effector position
-        ee_pos, _ = self._get_current_ee_pose(joint_pos)
+        links_arr = self._get_link_positions(configs)
         
-        # Get robot base position (assuming it's at index 0)
-        # We can access the robot base position or use a fixed threshold for table height
-        # Here, we'll use a simple approach to check if ee_pos[2] (z-coordinate) is above a threshold
+        # end effector above the table (same margin as _check_valid)
+        valid = links_arr[:, -1, 2] > self.robot.pos[2] + 0.01
         
-        # Get base link position
-        # base_pos = p.getBasePositionAndOrientation(self.robot.id)[0]
-        base_height = self.robot.pos[2]
+        obstacles = self._get_obstacle_arrays()
+        if obstacles is not None:
+            valid &= ~self._links_hit_obstacles(links_arr, *obstacles)
+        return valid
+    
+    def _check_valid(self, joint_pos: List[float]) -> bool:
+        """Height and obstacle check of one joint state from a single FK pass.
+        
+        Args:
+            joint_pos: Joint positions to check
+            
+        Returns:
+            True if the end effector is above the table and no link is near an obstacle
+        """
+        # Positions of all arm links and the end effector (last row) in one batch
+        links_arr = self._get_link_positions([joint_pos])
         
-        # Add a small threshold to account for the base height itself
-        table_height = base_height + 0.01  # 1cm margin below base
+        # End effector must stay above the table: 1cm margin above the robot base height
+        if links_arr[0, -1, 2] <= self.robot.pos[2] + 0.01:
+            return False
         
-        # Check if end effector is above the table height
-        return ee_pos[2] > table_height
+        obstacles = self._get_obstacle_arrays()
+        if obstacles is None:
+            return True
+        return not self._links_hit_obstacles(links_arr, *obstacles)[0]
    
     def _is_collision_free(self, joints: List[float]) -> bool:
         """Check if a joint configuration is collision-free.
         
+        Results are memoized on the configuration quantized to COLLISION_CACHE_RESOLUTION.
+        
         Args:
             joints: Joint configuration
         """
-        return self._is_ee_height_valid(joints) and not self._is_state_in_collision(joints)
+        key = tuple(np.rint(np.asarray(joints) / self.COLLISION_CACHE_RESOLUTION).astype(np.int32).tolist())
+        return self._collision_free_quantized(key)
+    
+    def _collision_free_quantized_uncached(self, key: Tuple[int, ...]) -> bool:
+        """Collision check of the configuration represented by a quantized cache key."""
+        joints = np.asarray(key, dtype=np.float64) * self.COLLISION_CACHE_RESOLUTION
+        return self._check_valid(joints)
     
-    def _sample_random_config(self) -> List[float]:
+    def _draw_uniform_config(self, batch_size: int = 256) -> np.ndarray:
+        """Next uniform joint sample from the pre-generated block, refilled when exhausted."""
+        if self._sample_idx >= len(self._sample_buf):
+            self._sample_buf = self._rng.uniform(self._lo, self._hi, size=(batch_size, self.dimension))
+            self._sample_idx = 0
+        config = self._sample_buf[self._sample_idx].copy()
+        self._sample_idx += 1
+        return config
+    
+    def _set_informed_frame(self, start_config: np.ndarray, goal_config: np.ndarray) -> None:
+        """Set up the ellipsoid frame for a start/goal pair and forget any previous solution."""
+        self._c_best = np.inf
+        axis = goal_config - start_config
+        self._c_min = math.sqrt(axis.dot(axis))
+        self._informed_center = 0.5 * (start_config + goal_config)
+        
+        # Householder reflection taking the first unit vector onto the start->goal direction
+        self._informed_C = np.eye(self.dimension)
+        if self._c_min > 1e-12:
+            u = -axis / self._c_min
+            u[0] += 1.0
+            uu = u.dot(u)
+            if uu > 1e-12:
+                self._informed_C -= (2.0 / uu) * np.outer(u, u)
+    
+    def _draw_informed_config(self) -> np.ndarray:
+        """Uniform sample from the informed ellipsoid of the current best path cost."""
+        x = self._rng.standard_normal(self.dimension)
+        x *= self._rng.random() ** (1.0 / self.dimension) / math.sqrt(x.dot(x))
+        radii = np.full(self.dimension, 0.5 * math.sqrt(max(self._c_best ** 2 - self._c_min ** 2, 0.0)))
+        radii[0] = 0.5 * self._c_best
+        return self._informed_center + self._informed_C @ (radii * x)
+    
+    def _sample_random_config(self) -> np.ndarray:
         """Sample random joint configuration.
         
         Returns:
@@ -248,8 +505,13 @@ class RRTStarPlanner:
         max_attempts = 50  # Maximum number of attempts to find valid configuration
         
         for _ in range(max_attempts):
-            # Sample random joint configuration
-            config = [random.uniform(low, high) for low, high in zip(self.robot.lower_limits, self.robot.upper_limits)]
+            # Sample random joint configuration, from the informed ellipsoid once a path is known
+            if self._c_best < np.inf and self._rng.random() < self.INFORMED_SAMPLE_RATE:
+                config = self._draw_informed_config()
+                if np.any(config < self._lo) or np.any(config > self._hi):
+                    continue
+            else:
+                config = self._draw_uniform_config()
             
             # Check if this configuration keeps the end effector above the table
             if self._is_collision_free(config):
@@ -258,35 +520,78 @@ class RRTStarPlanner:
         # If we couldn't find a valid configuration after max_attempts, 
         # return the last sampled configuration and let collision checking handle it
         print("Warning: Could not sample configuration with valid end effector height")
-        return [random.uniform(low, high) for low, high in zip(self.robot.lower_limits, self.robot.upper_limits)]
+        return self._draw_uniform_config()
     
-    def _steer(self, from_config: List[float], to_config: List[float]) -> List[float]:
+    def _steer(self, from_config: List[float], to_config: List[float], from_idx: Optional[int] = None) -> List[float]:
         """Steer from one configuration toward another with step size limit.
         
         Args:
             from_config: Starting joint configuration
             to_config: Target joint configuration
+            from_idx: Tree index of from_config, used to cache the checked edge
             
         Returns:
             New configuration after stepping toward target
         """
-        dist = np.linalg.norm(to_config - from_config)
-        
-        if dist < self.step_size:
-            # If directly reaching to_config, check height validity
-            if self._is_collision_free(to_config):
-                return to_config
-            else:
-                return from_config
+        diff = to_config - from_config
+        dist_sq = diff.dot(diff)
+        
+        # Adapt the step to how often recent extensions got through: long edges in open
+        # space, back toward the base step once extensions start getting blocked.
+        # An enlarged step must also have a collision-free edge; if it does not, fall back
+        # to the base step so cluttered regions are still explored at the original resolution
+        if self.adaptive_step and self._succ and dist_sq > self.step_size ** 2:
+            success_rate = sum(self._succ) / len(self._succ)
+            step = min(self.step_size * (1.0 + self.step_extend_d * success_rate), 3.0 * self.step_size)
+            if step > self.step_size:
+                new_config = to_config if dist_sq < step ** 2 else from_config + (step / math.sqrt(dist_sq)) * diff
+                if self._is_collision_free(new_config) and self._is_edge_collision_free(from_config, new_config):
+                    # Only a free edge is cached: on a blocked one the candidate node becomes the
+                    # base-step config instead. _n is the index the candidate will be added at.
+                    if from_idx is not None:
+                        self._edge_free_cache[frozenset((from_idx, self._n))] = True
+                    return new_config
+        
+        if dist_sq < self.step_size ** 2:
+            # Directly reaching to_config
+            new_config = to_config
         else:
-            dir_vec = (to_config - from_config) / dist
-            new_config = from_config + self.step_size * dir_vec
+            new_config = from_config + (self.step_size / math.sqrt(dist_sq)) * diff
+        
+        # Check height validity and collisions of new_config
+        if self._is_collision_free(new_config):
+            return new_config
+        return from_config
+    
+    def _is_edge_collision_free(self, from_config: List[float], to_config: List[float], key=None) -> bool:
+        """Check the straight joint-space edge between two configurations.
+        
+        The interior of the edge is sampled every collision_check_step and all samples
+        are checked in one batch; the endpoints are assumed to have been checked already.
+        
+        Args:
+            from_config: Start of the edge
+            to_config: End of the edge
+            key: Optional cache key (frozenset of the two node indices) for edges between tree nodes
             
-            # Check height validity of new_config
-            if self._is_collision_free(new_config):
-                return new_config
-            else:
-                return from_config
+        Returns:
+            True if every sample along the edge is collision-free
+        """
+        if key is not None and key in self._edge_free_cache:
+            return self._edge_free_cache[key]
+        
+        from_config = np.asarray(from_config)
+        edge = np.asarray(to_config) - from_config
+        n_steps = math.ceil(math.sqrt(edge.dot(edge)) / self.collision_check_step)
+        if n_steps > 1:
+            t = np.arange(1, n_steps)[:, None] / n_steps
+            edge_free = bool(self._configs_collision_free(from_config + t * edge).all())
+        else:
+            edge_free = True
+        
+        if key is not None:
+            self._edge_free_cache[key] = edge_free
+        return edge_free
     
     def _choose_parent(self, new_node: List[float], nearby_indices: List[int]) -> Tuple[int, float]:
         """Choose best parent for new node from nearby nodes.
@@ -301,28 +606,33 @@ class RRTStarPlanner:
         if not nearby_indices:
             return -1, float('inf')
             
-        costs = []
-        for idx in nearby_indices:
-            # Cost from start to potential parent
-            cost_to_parent = self.costs[idx]
-            # Cost from parent to new node
-            cost_to_new = np.linalg.norm(self.nodes[idx] - new_node)
-            
-            # Check if path is collision-free
-            if self._is_collision_free(new_node):
-                # Total cost
-                costs.append((idx, cost_to_parent + cost_to_new))
-            else:
-                costs.append((idx, float('inf')))
-                
-        # sort by cost
-        costs.sort(key=lambda x: x[1])
-        
-        # Make sure not all nearby nodes are filtered out, and no collision
-        if costs and costs[0][1] < float('inf'): 
-            return costs[0]
-        else:
+        # new_node itself only needs to be checked once for all candidates
+        if not self._is_collision_free(new_node):
             return -1, float('inf')
+            
+        # Cost from start through each potential parent, for all candidates at once
+        candidates = np.asarray(nearby_indices)
+        diffs = self._nodes_arr[candidates] - new_node
+        costs = self._costs_arr[candidates] + np.sqrt(np.einsum('ij,ij->i', diffs, diffs))
+        
+        # Lazily sweep the edges in cost order: the first collision-free one is the best parent.
+        # new_node will be added at index _n, so the results are cached for _rewire
+        for k in np.argsort(costs, kind='stable'):
+            idx = int(candidates[k])
+            if self._is_edge_collision_free(self._nodes_arr[idx], new_node, key=frozenset((idx, self._n))):
+                return idx, float(costs[k])
+        return -1, float('inf')
+    
+    def _forget_candidate_edges(self, indices: List[int]) -> None:
+        """Drop cached edges into a candidate node that was not added to the tree.
+        
+        Its index _n is reused by the next node, so the cached results would be stale.
+        
+        Args:
+            indices: Tree indices the candidate's edges were checked from
+        """
+        for idx in indices:
+            self._edge_free_cache.pop(frozenset((int(idx), self._n)), None)
     
     def _rewire(self, new_node_idx: int, nearby_indices: List[int]) -> None:
         """Rewire the tree to potentially improve paths.
@@ -331,52 +641,85 @@ class RRTStarPlanner:
             new_node_idx: Index of new node
             nearby_indices: Indices of nearby nodes
         """
-        new_node = self.nodes[new_node_idx]
+        if not nearby_indices:
+            return
+        new_node = self._nodes_arr[new_node_idx]
+        
+        # Edge lengths from the new node to all candidates at once
+        diffs = self._nodes_arr[nearby_indices] - new_node
+        edge_lengths = np.sqrt(np.einsum('ij,ij->i', diffs, diffs))
         
-        for idx in nearby_indices:
-            if idx == self.parents[new_node_idx]:
+        for idx, edge_length in zip(nearby_indices, edge_lengths.tolist()):
+            if idx == self._parents_arr[new_node_idx]:
                 continue
                 
-            # Check if better path exists through new node
-            cost_through_new = self.costs[new_node_idx] + np.linalg.norm(self.nodes[idx] - new_node)
-            
-            if cost_through_new < self.costs[idx]:
-                # Check if path is collision-free
-                if self._is_collision_free(new_node):
-                    # Update parent and cost
-                    self.parents[idx] = new_node_idx
-                    self.costs[idx] = cost_through_new
+            # Check if better path exists through new node (costs can drop while rewiring)
+            cost_through_new = self._costs_arr[new_node_idx] + edge_length
+            
+            if cost_through_new < self._costs_arr[idx]:
+                # Check if the edge from the new node is collision-free
+                if self._is_edge_collision_free(new_node, self._nodes_arr[idx], key=frozenset((new_node_idx, idx))):
+                    # Update parent and cost; the whole subtree below idx gets cheaper by the same amount
+                    self._parents_arr[idx] = new_node_idx
+                    self._propagate_cost(idx, cost_through_new - self._costs_arr[idx])
                     
                     # Update visualization
-                    self._update_visualization(idx)
+                    if self._viz:
+                        self._update_visualization(idx)
 
+    def _propagate_cost(self, node_idx: int, delta: float) -> None:
+        """Add delta to the cost of a node and of all its descendants."""
+        parents = self._parents_arr[:self._n]
+        subtree = np.array([node_idx])
+        while subtree.size:
+            self._costs_arr[subtree] += delta
+            subtree = np.nonzero(np.isin(parents, subtree))[0]
+    
     def _update_visualization(self, node_idx: int) -> None:
         """Update visualization of tree.
         
         Args:
             node_idx: Index of node to update
         """
-        if self.parents[node_idx] == -1:
+        parent_idx = int(self._parents_arr[node_idx])
+        if parent_idx == -1:
             return
-            
-        parent_idx = self.parents[node_idx]
         
-        # Remove old visualization
-        for i, (start, end) in enumerate(self.debug_lines):
-            if np.array_equal(end, self.nodes[node_idx]):
-                p.removeUserDebugItem(self.debug_lines[i][2])
-                self.debug_lines.pop(i)
-                break
-                
-        # Add new visualization
-        start_ee, _ = self._get_current_ee_pose(self.nodes[parent_idx])
-        end_ee, _ = self._get_current_ee_pose(self.nodes[node_idx])
-        
-        debug_id = p.addUserDebugLine(
-            start_ee, end_ee, [0, 1, 0], 2, 0
+        # Replace the old edge in place (from the cached end-effector positions)
+        old_id = self._debug_by_node.get(node_idx, -1)
+        self._debug_by_node[node_idx] = p.addUserDebugLine(
+            self._ee_arr[parent_idx], self._ee_arr[node_idx], [0, 1, 0], 2, 0,
+            replaceItemUniqueId=old_id
         )
+    
+    def _add_node(self, config: List[float], cost: float, parent_idx: int) -> int:
+        """Append a node to the tree and draw the edge from its parent.
         
-        self.debug_lines.append((self.nodes[parent_idx], self.nodes[node_idx], debug_id))
+        Args:
+            config: Joint configuration of the new node
+            cost: Cost from start to the new node
+            parent_idx: Index of the parent node
+            
+        Returns:
+            Index of the new node
+        """
+        self._grow_if_needed()
+        new_node_idx = self._n
+        self._nodes_arr[new_node_idx] = config
+        self._costs_arr[new_node_idx] = cost
+        self._parents_arr[new_node_idx] = parent_idx
+        self._buckets.setdefault(tuple(self._bucket_key(self._nodes_arr[new_node_idx])), []).append(new_node_idx)
+        self._n += 1
+        
+        # Add visualization
+        if not self._viz:
+            return new_node_idx
+        self._ee_arr[new_node_idx] = self._get_current_ee_pose(config)[0]
+        if parent_idx != -1:
+            self._debug_by_node[new_node_idx] = p.addUserDebugLine(
+                self._ee_arr[parent_idx], self._ee_arr[new_node_idx], [0, 1, 0], 2, 0
+            )
+        return new_node_idx
     
     def _extract_path(self, goal_idx: int) -> List[List[float]]:
             """Extract path from start to goal.
@@ -391,13 +734,43 @@ class RRTStarPlanner:
             current = goal_idx
             
             while current != -1:  # -1 means no parent (start node)
-                path.append(self.nodes[current])
-                current = self.parents[current]
+                path.append(self._nodes_arr[current].copy())
+                current = self._parents_arr[current]
                 
             return path[::-1]  # Reverse to get path from start to goal
 
-    def plan(self, start_config: List[float], goal_config: List[float]) -> Tuple[List[List[float]], float]:
-        """Plan a path from start to goal configuration.
+    def _extend(self, target: np.ndarray) -> int:
+        """One RRT* extension of the active tree toward target.
+        
+        Args:
+            target: Configuration to grow toward
+            
+        Returns:
+            Index of the added node, or -1 if the extension was blocked
+        """
+        nearest_idx = self._find_nearest(target)
+        from_config = self._nodes_arr[nearest_idx]
+        new_config = self._steer(from_config, target, nearest_idx)
+        if np.array_equal(new_config, from_config):
+            self._succ.append(False)
+            return -1
+        
+        nearby_indices = self._find_nearby(new_config)
+        best_parent_idx, cost_to_new = self._choose_parent(new_config, nearby_indices)
+        self._succ.append(best_parent_idx != -1)
+        if best_parent_idx == -1:
+            self._forget_candidate_edges([nearest_idx, *nearby_indices])
+            return -1
+        
+        new_node_idx = self._add_node(new_config, cost_to_new, best_parent_idx)
+        self._rewire(new_node_idx, nearby_indices)
+        return new_node_idx
+    
+    def _plan_connect(self, start_config: np.ndarray, goal_config: np.ndarray) -> Tuple[List[List[float]], float]:
+        """Bidirectional RRT*-Connect between a tree rooted at start and one rooted at goal.
+        
+        Each iteration extends the active tree toward a random sample, then swaps trees and
+        repeatedly extends the other one toward the new node until it is reached or blocked.
         
         Args:
             start_config: Starting joint configuration
@@ -406,104 +779,203 @@ class RRTStarPlanner:
         Returns:
             Tuple of (path as list of joint configurations, path cost)
         """
-        print("Starting RRT* planning with base height constraint...")
-            
-        # Initialize RRT* tree
-        self.nodes = [start_config]
-        self.costs = [0.0]
-        self.parents = [-1]  # no parent for start node
-        self.debug_lines = []
+        print("Starting bidirectional RRT*-Connect planning with base height constraint...")
+        
+        # Lines of the previous query's trees would otherwise be orphaned by reset()
+        self.clear_visualization()
+        
+        # Goal tree goes into _other_tree, start tree gets fresh buffers and is active
+        self.reset(goal_config)
+        self._other_tree = {name: getattr(self, name) for name in self.TREE_ATTRS}
+        self._alloc_tree_buffers(len(self._nodes_arr))
+        self.reset(start_config)
+        start_active = True
         
-        # RRT* main loop
         for i in range(self.max_iterations):
             if i % 100 == 0:
-                print(f"RRT* planning iteration {i}/{self.max_iterations}")
+                print(f"RRT*-Connect planning iteration {i}/{self.max_iterations}")
+            
+            new_node_idx = self._extend(self._sample_random_config())
+            self._swap_trees()
+            start_active = not start_active
+            if new_node_idx == -1:
+                continue
+            
+            # Connect: grow the other tree toward the new node until blocked or reached
+            target = self._other_tree['_nodes_arr'][new_node_idx].copy()
+            while True:
+                connect_idx = self._extend(target)
+                if connect_idx == -1:
+                    break
+                gap = self._nodes_arr[connect_idx] - target
+                if gap.dot(gap) < self.goal_threshold ** 2:
+                    print(f"Trees connected after {i+1} iterations!")
+                    
+                    # Splice the start-rooted path with the reversed goal-rooted path
+                    path_here = self._extract_path(connect_idx)
+                    cost = float(self._costs_arr[connect_idx]) + math.sqrt(gap.dot(gap))
+                    self._swap_trees()
+                    start_active = not start_active
+                    path_there = self._extract_path(new_node_idx)
+                    cost += float(self._costs_arr[new_node_idx])
+                    
+                    start_path, goal_path = (path_there, path_here) if start_active else (path_here, path_there)
+                    goal_path = goal_path[::-1]
+                    if np.array_equal(start_path[-1], goal_path[0]):
+                        goal_path = goal_path[1:]
+                    if not start_active:
+                        self._swap_trees()
+                    return start_path + goal_path, cost
+        
+        # Fall back to the start-tree node closest to the goal
+        if not start_active:
+            self._swap_trees()
+        closest_idx = int(np.argmin(self._sq_dists(goal_config)))
+        return self._extract_path(closest_idx), float(self._costs_arr[closest_idx])
+    
+    def reset(self, start_config: List[float]) -> None:
+        """Clear the tree so the planner instance can be reused for a new query.
+        
+        Args:
+            start_config: Root joint configuration of the new tree
+        """
+        self._debug_by_node = {}
+        self._edge_free_cache = {}
+        self._succ.clear()
+        self._buckets = {}
+        self._n = 0
+        self._add_node(start_config, 0.0, -1)  # no parent for start node
+
+    def plan(self, start_config: List[float], goal_config: List[float]) -> Tuple[List[List[float]], float]:
+        """Plan a path from start to goal configuration.
+        
+        Args:
+            start_config: Starting joint configuration
+            goal_config: Goal joint configuration
+            
+        Returns:
+            Tuple of (path as list of joint configurations, path cost)
+        """
+        start_config = np.asarray(start_config, dtype=np.float64)
+        goal_config = np.asarray(goal_config, dtype=np.float64)
+        
+        # Joint moves are kept virtual during planning and undone once at the end
+        self._planning = True
+        try:
+            # Cached collision results are stale once obstacles move
+            self._collision_free_quantized.cache_clear()
+            if self.bidirectional:
+                return self._plan_connect(start_config, goal_config)
+            
+            print("Starting RRT* planning with base height constraint...")
+            
+            # Initialize RRT* tree, removing the lines of the previous query's tree first
+            self.clear_visualization()
+            self.reset(start_config)
+            self._set_informed_frame(start_config, goal_config)
+            goal_th_sq = self.goal_threshold ** 2
+            goal_idx = -1
+            refine_until = self.max_iterations
+        
+            # RRT* main loop
+            for i in range(self.max_iterations):
+                if i % 100 == 0:
+                    print(f"RRT* planning iteration {i}/{self.max_iterations}")
                 
-            # Sample random configuration (with bias toward goal)
-            if random.random() < self.goal_sample_rate:
-                random_config = goal_config
-            else:
-                random_config = self._sample_random_config()
+                # Sample random configuration (with bias toward goal)
+                if self._rng.random() < self.goal_sample_rate:
+                    random_config = goal_config
+                else:
+                    random_config = self._sample_random_config()
                 
-            # Find nearest node
-            nearest_idx = self._find_nearest(random_config)
+                # Find nearest node
+                nearest_idx = self._find_nearest(random_config)
             
-            # Steer toward random config
-            new_config = self._steer(self.nodes[nearest_idx], random_config)
+                # Steer toward random config
+                nearest_config = self._nodes_arr[nearest_idx]
+                new_config = self._steer(nearest_config, random_config, nearest_idx)
                 
-            # Find nearby nodes
-            nearby_indices = self._find_nearby(new_config)
+                # Find nearby nodes
+                nearby_indices = self._find_nearby(new_config)
             
-            # Choose best parent
-            best_parent_idx, cost_to_new = self._choose_parent(new_config, nearby_indices)
-            
-            if best_parent_idx == -1:
-                # No valid parent found
-                continue
+                # Choose best parent
+                best_parent_idx, cost_to_new = self._choose_parent(new_config, nearby_indices)
                 
-            # Add node to the tree
-            self.nodes.append(new_config)
-            self.costs.append(cost_to_new)
-            self.parents.append(best_parent_idx)
-            new_node_idx = len(self.nodes) - 1
-            
-            # Add visualization
-            start_ee, _ = self._get_current_ee_pose(self.nodes[best_parent_idx])
-            end_ee, _ = self._get_current_ee_pose(new_config)
-            
-            debug_id = p.addUserDebugLine(
-                start_ee, end_ee, [0, 1, 0], 2, 0
-            )
+                # An extension succeeds if the step got through and found a collision-free parent edge
+                self._succ.append(new_config is not nearest_config and best_parent_idx != -1)
             
-            self.debug_lines.append((self.nodes[best_parent_idx], new_config, debug_id))
-            
-            # Rewire the tree
-            self._rewire(new_node_idx, nearby_indices)
+                if best_parent_idx == -1:
+                    # No valid parent found
+                    self._forget_candidate_edges([nearest_idx, *nearby_indices])
+                    continue
+                
+                # Add node to the tree
+                new_node_idx = self._add_node(new_config, cost_to_new, best_parent_idx)
             
-            # Check if we've reached the goal
-            if np.linalg.norm(np.array(goal_config) - np.array(new_config)) < self.goal_threshold:
-                print(f"Goal reached after {i+1} iterations!")
+                # Check if we've reached the goal
+                goal_diff = goal_config - new_config
+                goal_dist_sq = goal_diff.dot(goal_diff)
                 
-                # Add goal node if not already part of the tree
-                if np.linalg.norm(np.array(new_config) - np.array(goal_config)) > 1e-6 and self._is_collision_free(goal_config):
-                    # Add goal node
-                    self.nodes.append(goal_config)
-                    cost_to_goal = cost_to_new + np.linalg.norm(np.array(goal_config) - np.array(new_config))
-                    self.costs.append(cost_to_goal)
-                    self.parents.append(new_node_idx)
-                    new_node_idx = len(self.nodes) - 1
-                    
-                    # Add visualization
-                    start_ee, _ = self._get_current_ee_pose(self.nodes[best_parent_idx])
-                    end_ee, _ = self._get_current_ee_pose(new_config)
-                    
-                    debug_id = p.addUserDebugLine(
-                        start_ee, end_ee, [0, 1, 0], 2, 0
-                    )
-                    
-                    self.debug_lines.append((self.nodes[best_parent_idx], new_config, debug_id))
-                    
-                    # Rewire the tree
+                # Rewire the tree, unless this node ends the search (rewiring cannot shorten
+                # the path through it once we stop)
+                terminating = goal_dist_sq < goal_th_sq and goal_idx == -1 and self.refine_iterations <= 0
+                if not terminating:
                     self._rewire(new_node_idx, nearby_indices)
+                
+                if goal_dist_sq < goal_th_sq:
+                    if goal_idx == -1:
+                        print(f"Goal reached after {i+1} iterations!")
                     
-                   
-                    goal_idx = new_node_idx
-                else:
-                    goal_idx = new_node_idx
-                    
+                        # Add goal node if not already part of the tree
+                        if goal_dist_sq > 1e-12 and self._is_collision_free(goal_config):
+                            # Add goal node
+                            cost_to_goal = cost_to_new + math.sqrt(goal_dist_sq)
+                            new_node_idx = self._add_node(goal_config, cost_to_goal, new_node_idx)
+                        
+                            # Rewire the tree
+                            if not terminating:
+                                self._rewire(new_node_idx, nearby_indices)
+                        
+                            goal_idx = new_node_idx
+                        else:
+                            goal_idx = new_node_idx
+                        
+                        if self.refine_iterations <= 0:
+                            break
+                        refine_until = min(i + self.refine_iterations, self.max_iterations - 1)
+                    elif self._costs_arr[new_node_idx] + math.sqrt(goal_dist_sq) < self._costs_arr[goal_idx]:
+                        # Cheaper way into the goal: adopt the new node if it is the goal, else re-parent the goal node
+                        if goal_dist_sq <= 1e-12:
+                            goal_idx = new_node_idx
+                        elif self._is_edge_collision_free(new_config, goal_config):
+                            self._parents_arr[goal_idx] = new_node_idx
+                            self._propagate_cost(goal_idx, self._costs_arr[new_node_idx] + math.sqrt(goal_dist_sq)
+                                                 - self._costs_arr[goal_idx])
+                            if self._viz:
+                                self._update_visualization(goal_idx)
+                
+                if goal_idx != -1:
+                    # Rewiring may have shortened the path; later samples come from its ellipsoid
+                    self._c_best = float(self._costs_arr[goal_idx])
+                    if i >= refine_until:
+                        break
+            
+            if goal_idx != -1:
                 # Extract path
                 path = self._extract_path(goal_idx)
-                path_cost = self.costs[goal_idx]
+                path_cost = float(self._costs_arr[goal_idx])
                 
                 return path, path_cost
         
-        # Try to find closest node to goal
-        dists_to_goal = [np.linalg.norm(node - goal_config) for node in self.nodes]
-        closest_idx = dists_to_goal.index(min(dists_to_goal))
+            # Try to find closest node to goal
+            closest_idx = int(np.argmin(self._sq_dists(goal_config)))
         
-        # Extract path to closest node
-        path = self._extract_path(closest_idx)
-        path_cost = self.costs[closest_idx]
+            # Extract path to closest node
+            path = self._extract_path(closest_idx)
+            path_cost = float(self._costs_arr[closest_idx])
         
-        return path, path_cost
+            return path, path_cost
     
+        finally:
+            self._planning = False
+            self._restore_joints()
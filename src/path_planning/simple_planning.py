@@ -1,7 +1,7 @@
 import numpy as np
 import pybullet as p
 
-from typing import List
+from typing import Callable, List, Optional
 
 from src.ik_solver.ik_solver import DifferentialIKSolver
 
@@ -40,7 +40,9 @@ class SimpleTrajectoryPlanner:
                                     start_joints: List[float], 
                                     target_pos: np.ndarray, 
                                     target_orn: List[float], 
-                                    steps: int = 100) -> List[List[float]]:
+                                    steps: int = 100,
+                                    ik_solver: Optional[DifferentialIKSolver] = None,
+                                    ik_fn: Optional[Callable] = None) -> List[List[float]]:
         """
         Generate a linear trajectory in Cartesian space
         
@@ -52,9 +54,12 @@ class SimpleTrajectoryPlanner:
         target_pos: Target position
         target_orn: Target orientation
         steps: Number of interpolation steps
+        ik_solver: Optional solver to reuse, a new one is created if None
+        ik_fn: Optional IK function (target_pos, target_orn, seed_joints) -> joint positions
+            or None on failure; used instead of ik_solver when given
         
         Returns:
-        trajectory: List of joint positions
+        trajectory: List of joint positions, empty if IK fails for a waypoint
         """
         # Set starting position
         for i, joint_idx in enumerate(arm_idx):
@@ -68,7 +73,10 @@ class SimpleTrajectoryPlanner:
         trajectory = []
         
         # Initialize IK solver
-        ik_solver = DifferentialIKSolver(robot_id, ee_idx, damping=0.05)
+        if ik_fn is None:
+            if ik_solver is None:
+                ik_solver = DifferentialIKSolver(robot_id, ee_idx, damping=0.05)
+            ik_fn = lambda pos, orn, seed: ik_solver.solve(pos, orn, seed, max_iters=50, tolerance=0.001)
         
         for step in range(steps + 1):
             t = step / steps  # Normalized step
@@ -77,7 +85,10 @@ class SimpleTrajectoryPlanner:
             pos = start_pos + t * (target_pos - start_pos)
             
             # Solve IK for current Cartesian position
-            current_joints = ik_solver.solve(pos, target_orn, start_joints, max_iters=50, tolerance=0.001)
+            current_joints = ik_fn(pos, target_orn, start_joints)
+            if current_joints is None:
+                print(f"IK failed for Cartesian waypoint {step}/{steps}")
+                return []
             
             # Add solution to trajectory
             trajectory.append(current_joints)
@@ -3,12 +3,60 @@ import matplotlib.pyplot as plt
 import pybullet as p
 import open3d as o3d
 import time
+from functools import lru_cache
 
 from src.ik_solver.ik_solver import DifferentialIKSolver
 from src.path_planning.simple_planning import SimpleTrajectoryPlanner
+from src.utils import njit, prange, NUMBA_AVAILABLE
 
 
 
+@lru_cache(maxsize=8)
+def _pixel_ray_lut(width, height, fx, fy, cx, cy):
+    """
+    Normalized camera ray per pixel column and row, computed once per camera setup
+    
+    Parameters:
+    width, height: Image size (pixels)
+    fx, fy, cx, cy: Camera intrinsics
+    
+    Returns:
+    u_norm (W,) and v_norm (H,) float32, so pixel (row, col) at depth z unprojects to
+    (u_norm[col] * z, v_norm[row] * z, z); read-only, as they are shared between calls
+    """
+    # Negative sign due to PyBullet camera direction
+    u_norm = (-(np.arange(width) - cx) / fx).astype(np.float32)
+    v_norm = (-(np.arange(height) - cy) / fy).astype(np.float32)
+    u_norm.flags.writeable = False
+    v_norm.flags.writeable = False
+    return u_norm, v_norm
+
+
+@njit(parallel=True, fastmath=True, cache=True)
+def _unproject_fused(depth, rows, cols, rgb, u_norm, v_norm, near, far, R, t, out_pts, out_col):
+    """
+    Depth buffer to world-frame points and colors in one pass over the masked pixels
+    
+    Parameters:
+    depth: Depth buffer values from PyBullet (H, W)
+    rows, cols: Pixel coordinates of the target mask (N,)
+    rgb: RGB(A) image (H, W, C)
+    u_norm, v_norm: Normalized rays per column/row from _pixel_ray_lut
+    near, far: Near/far plane distances
+    R, t: Camera rotation (camera to world) and position
+    out_pts, out_col: Preallocated (N, 3) outputs for float32 world points and uint8 colors
+    """
+    for k in prange(rows.shape[0]):
+        v = rows[k]
+        u = cols[k]
+        z = far * near / (far - (far - near) * depth[v, u])
+        xc = u_norm[u] * z
+        yc = v_norm[v] * z
+        for i in range(3):
+            out_pts[k, i] = R[i, 0] * xc + R[i, 1] * yc + R[i, 2] * z + t[i]
+            out_col[k, i] = rgb[v, u, i]
+
+
 def visualize_depth_image(depth_image, highlight_point=None, mask=None):
     """
     Visualize depth image, and draw a point at the specified position
@@ -55,6 +103,11 @@ class PointCloudCollector:
         """
         self.config = config
         self.sim = sim
+        # reused across collect_point_clouds() calls (one per grasp attempt)
+        self.ik_solver = DifferentialIKSolver(sim.robot.id, sim.robot.ee_idx, damping=0.05)
+        # camera mounting rotation relative to the end effector is fixed by the config
+        ee_cam_orn = config["world_settings"]["camera"]["ee_cam_orientation"]
+        self._ee_cam_R = np.array(p.getMatrixFromQuaternion(ee_cam_orn)).reshape(3, 3)
         
     def _convert_depth_to_meters(self, depth_buffer, near, far):
         """
@@ -69,7 +122,9 @@ class PointCloudCollector:
         """
         return far * near / (far - (far - near) * depth_buffer)
 
-    def _get_camera_intrinsic(self, width, height, fov):
+    @staticmethod
+    @lru_cache(maxsize=8)
+    def _get_camera_intrinsic(width, height, fov):
         """
         Calculate intrinsic matrix from camera parameters
         
@@ -79,7 +134,7 @@ class PointCloudCollector:
         fov: Vertical field of view (degrees)
 
         Returns:
-        Camera intrinsic matrix
+        Camera intrinsic matrix (cached per camera setup, read-only)
         """    
         # Calculate focal length
         f = height / (2 * np.tan(np.radians(fov / 2)))
@@ -93,78 +148,55 @@ class PointCloudCollector:
             [0, f, cy],
             [0, 0, 1]
         ])
+        intrinsic_matrix.flags.writeable = False
         
         return intrinsic_matrix
 
-    def _depth_image_to_point_cloud(self, depth_image, mask, rgb_image, intrinsic_matrix):
+    def _unproject_pixels(self, rows, cols, depths, rgb_image, ray_lut):
         """
-        Convert depth image to point cloud in camera coordinate system
+        Unproject masked pixels to a point cloud in camera coordinate system
         
         Parameters:
-        depth_image: Depth image (meters)
-        mask: Target object mask (boolean array)
+        rows, cols: Pixel coordinates of the target mask (from np.nonzero)
+        depths: Metric depth of each of those pixels (meters, float32)
         rgb_image: RGB image
-        intrinsic_matrix: Camera intrinsic matrix
+        ray_lut: (u_norm, v_norm) normalized rays per column/row from _pixel_ray_lut
         
         Returns:
-        Point cloud in camera coordinates (N,3) and corresponding colors (N,3)
+        Point cloud in camera coordinates (N,3) float32 and corresponding uint8 colors (N,3)
         """
-        # Extract pixel coordinates from target mask
-                # Convert image coordinates to camera coordinates
-    
-        rows, cols = np.where(mask)
-
-        # print(rows, cols)
-        # plt.imshow(rgb_image)
-        # plt.show()
-        # highlight_point = (cx,cy)
-        # visualize_depth_image(depth_image, highlight_point, mask)
-        # print("===========================================================",depth_image[int(cy), int(cx)])
-
         if len(rows) == 0:
             raise ValueError("No valid pixels found in target mask")
         
-        # Extract depth values for these pixels
-        depths = depth_image[rows, cols]
+        # Calculate camera coordinates from the precomputed pixel rays, written
+        # column by column into one contiguous (N,3) buffer
+        u_norm, v_norm = ray_lut
+        points = np.empty((len(rows), 3), dtype=np.float32)
+        np.multiply(u_norm[cols], depths, out=points[:, 0])
+        np.multiply(v_norm[rows], depths, out=points[:, 1])
+        points[:, 2] = depths
         
-        # Convert image coordinates to camera coordinates
-        fx = intrinsic_matrix[0, 0]
-        fy = intrinsic_matrix[1, 1]
-        cx = intrinsic_matrix[0, 2]
-        cy = intrinsic_matrix[1, 2]
-        
-        # Calculate camera coordinates
-        x = -(cols - cx) * depths / fx # Negative sign due to PyBullet camera direction
-        y = -(rows - cy) * depths / fy
-        z = depths
-        
-        # Stack points
-        points = np.vstack((x, y, z)).T
-        
-        # Extract RGB colors
-        colors = rgb_image[rows, cols, :3].astype(np.float64) / 255.0
+        # Extract RGB colors, kept as uint8 until they are handed to Open3D
+        colors = np.empty((len(rows), 3), dtype=np.uint8)
+        colors[:] = rgb_image[rows, cols, :3]
         
         return points, colors
 
-    def _transform_points_to_world(self, points, camera_extrinsic):
+    def _transform_points_to_world(self, points, camera_pos, camera_R):
         """
         Transform points from camera coordinate system to world coordinate system
         
         Parameters:
         points: Point cloud in camera coordinates (N,3)
-        camera_extrinsic: Camera extrinsic matrix (4x4)
+        camera_pos: Camera position in world coordinates
+        camera_R: Camera rotation matrix (from camera to world coordinates)
         
         Returns:
         Point cloud in world coordinates (N,3)
         """
-        # Convert point cloud to homogeneous coordinates
-        points_homogeneous = np.hstack((points, np.ones((points.shape[0], 1))))
-        
-        # Transform point cloud using extrinsic matrix
-        world_points_homogeneous = (camera_extrinsic @ points_homogeneous.T).T # Points in rows
-        
-        # Convert back to non-homogeneous coordinates
-        world_points = world_points_homogeneous[:, :3]
+        # Rotate then translate; same as the 4x4 extrinsic without the homogeneous copy
+        world_points = np.ascontiguousarray(points) @ np.asarray(camera_R, dtype=points.dtype).T
+        world_points += np.asarray(camera_pos, dtype=points.dtype)
         
         return world_points
     
@@ -181,16 +213,10 @@ class PointCloudCollector:
         
         # End effector rotation matrix
         ee_R = np.array(p.getMatrixFromQuaternion(ee_orn)).reshape(3, 3)
-        print("End effector orientation matrix:")
-        print(ee_R)
-        # Camera parameters
-        cam_cfg = self.config["world_settings"]["camera"]
-        ee_cam_orn = cam_cfg["ee_cam_orientation"]
-        ee_cam_R = np.array(p.getMatrixFromQuaternion(ee_cam_orn)).reshape(3, 3)
         # Calculate camera position
         camera_pos = ee_pos 
-        # Calculate camera rotation matrix
-        camera_R = ee_R @ ee_cam_R
+        # Calculate camera rotation matrix (camera mounting rotation precomputed in __init__)
+        camera_R = ee_R @ self._ee_cam_R
         
         return camera_pos, camera_R
     
@@ -237,28 +263,37 @@ class PointCloudCollector:
         
         # Create target object mask
         object_mask = (seg == target_mask_id)
-        if np.count_nonzero(object_mask) == 0:
+        rows, cols = np.nonzero(object_mask)
+        if len(rows) == 0:
             raise ValueError(f"Target mask ID {target_mask_id} not found in segmentation")
         
-        # Extract target object depth buffer values
-        metric_depth = self._convert_depth_to_meters(depth, near, far)
-        
-        # Get intrinsic matrix
+        # Get intrinsic matrix and the per-pixel rays (cached per camera setup)
         intrinsic_matrix = self._get_camera_intrinsic(width, height, fov)
-        
-        # Convert depth image to point cloud
-        points_cam, colors = self._depth_image_to_point_cloud(metric_depth, object_mask, rgb, intrinsic_matrix)
-        
-        # Build camera extrinsic matrix
-        camera_extrinsic = self._get_camera_extrinsic(camera_pos, camera_R)
-        
-        # Transform points to world coordinate system
-        points_world = self._transform_points_to_world(points_cam, camera_extrinsic)
+        ray_lut = _pixel_ray_lut(width, height, intrinsic_matrix[0, 0], intrinsic_matrix[1, 1],
+                                 intrinsic_matrix[0, 2], intrinsic_matrix[1, 2])
+        
+        if NUMBA_AVAILABLE:
+            # Depth conversion, unprojection and camera-to-world transform fused in one kernel
+            points_world = np.empty((len(rows), 3), dtype=np.float32)
+            colors = np.empty((len(rows), 3), dtype=np.uint8)
+            _unproject_fused(np.asarray(depth), rows, cols, np.asarray(rgb), ray_lut[0], ray_lut[1],
+                             float(near), float(far), np.asarray(camera_R, dtype=np.float64),
+                             np.asarray(camera_pos, dtype=np.float64), points_world, colors)
+        else:
+            # Extract target object depth buffer values; only masked pixels are converted to meters
+            depths = self._convert_depth_to_meters(np.asarray(depth)[rows, cols].astype(np.float32, copy=False),
+                                                   np.float32(near), np.float32(far))
+            
+            # Convert depth image to point cloud
+            points_cam, colors = self._unproject_pixels(rows, cols, depths, rgb, ray_lut)
+            
+            # Transform points to world coordinate system
+            points_world = self._transform_points_to_world(points_cam, camera_pos, camera_R)
         
         # Create Open3D point cloud object
         pcd = o3d.geometry.PointCloud()
         pcd.points = o3d.utility.Vector3dVector(points_world)
-        pcd.colors = o3d.utility.Vector3dVector(colors)
+        pcd.colors = o3d.utility.Vector3dVector(colors.astype(np.float32) * np.float32(1.0 / 255.0))
         
         return pcd
 
@@ -300,8 +335,7 @@ class PointCloudCollector:
         z_observe_orn = p.getQuaternionFromEuler([0, np.radians(-180), 0])  # Looking down
         
         # Solve IK
-        ik_solver = DifferentialIKSolver(self.sim.robot.id, self.sim.robot.ee_idx, damping=0.05)
-        high_point_target_joints = ik_solver.solve(z_observe_pos, z_observe_orn, initial_joints, max_iters=50, tolerance=0.001)
+        high_point_target_joints = self.ik_solver.solve(z_observe_pos, z_observe_orn, initial_joints, max_iters=50, tolerance=0.001)
         # Generate trajectory
         print("Generating trajectory for high observation point...")
         high_point_trajectory = SimpleTrajectoryPlanner.generate_joint_trajectory(initial_joints, high_point_target_joints, steps=100)
@@ -429,7 +463,6 @@ class PointCloudCollector:
         # Collect from each viewpoint
         for viewpoint_idx, (target_pos, target_orn) in enumerate(zip(target_positions, target_orientations)):
             print(f"\nMoving to viewpoint {viewpoint_idx + 1}")
-            self.sim.get_ee_renders()
             
             # Get current joint positions
             current_joints = self.sim.robot.get_joint_positions()
@@ -437,7 +470,7 @@ class PointCloudCollector:
             saved_joints = current_joints.copy()
             
             # Solve IK for target end effector pose
-            target_joints = ik_solver.solve(target_pos, target_orn, current_joints, max_iters=50, tolerance=0.001)
+            target_joints = self.ik_solver.solve(target_pos, target_orn, current_joints, max_iters=50, tolerance=0.001)
             
             # Reset to saved starting position
             for i, joint_idx in enumerate(self.sim.robot.arm_idx):
@@ -456,7 +489,8 @@ class PointCloudCollector:
                     saved_joints, 
                     target_pos, 
                     target_orn, 
-                    steps=100
+                    steps=100,
+                    ik_solver=self.ik_solver
                 )
             elif choice == 2:
                 print("Generating linear joint space trajectory...")
@@ -31,6 +31,8 @@ class Simulation:
         self.timestep = 1.0 / sim_settings["timestep_freq"]
         self.mode = sim_settings["mode"]
         self.gui_mode = p.GUI if sim_settings["mode"] > 0 else p.DIRECT
+        # wall-clock pacing is only useful when someone is watching the GUI
+        self.gui_enabled = self.gui_mode == p.GUI
         self.render_mode = p.ER_TINY_RENDERER
         self.target_object = spawn_object
         self.rng = np.random.RandomState(seed)
@@ -40,6 +42,9 @@ class Simulation:
         self.width = camera_settings["width"]
         self.height = camera_settings["height"]
         self.cam_render_flag = camera_settings["cam_render_flag"]
+        # the GUI camera output is only refreshed every N simulation steps
+        self.cam_render_every = max(1, int(camera_settings.get("cam_render_every", 1)))
+        self._step_count = 0
         aspect = self.width / self.height
         self.projection_matrix = p.computeProjectionMatrixFOV(
             camera_settings["fov"],
@@ -84,6 +89,38 @@ class Simulation:
             deterministicOverlappingPairs=1)
         self._load_objects(self.exp_settings)
 
+    def save_state(self) -> int:
+        """Snapshot the current world so it can be restored without reloading URDFs."""
+        return p.saveState()
+
+    def remove_state(self, state_id: int):
+        """Free a snapshot from save_state() once it is no longer needed."""
+        p.removeState(state_id)
+
+    def restore(self, state_id: int):
+        """Restore a snapshot from save_state() and re-sample the object pose.
+
+        Like reset() for the same object, but skips URDF parsing and
+        collision-mesh building. Unlike reset(), the obstacles restart from
+        their snapshot start positions; only their goals are drawn afresh.
+        """
+        p.restoreState(stateId=state_id)
+        if self.obstacles_flag:
+            # restoreState only moves the bodies back, so reset the motion
+            # state to what Obstacle.__init__ leaves after drawing its start
+            for obstacle in self.obstacles:
+                obstacle.point_id = 1
+                obstacle.current_goal = np.clip(
+                    obstacle.get_next_goal_point(),
+                    obstacle.l_lim, obstacle.u_lim)
+                obstacle.stopped = False
+        sim_settings = self.exp_settings["world_settings"]
+        self.obj_jitter = self.rng.uniform([-0.2, -0.2, 0], [0.2, 0.2, 0])
+        self.initial_position = sim_settings["default_obj_pos"] + self.obj_jitter
+        self.object.pos = self.initial_position
+        p.resetBasePositionAndOrientation(
+            self.object.id, self.initial_position, self.object.ori)
+
     @property
     def get_ground_tuth_position_object(self):
         return self.initial_position
@@ -216,7 +253,7 @@ class Simulation:
                     break
                 obstacle.move()
 
-        if self.cam_render_flag:
+        if self.cam_render_flag and self._step_count % self.cam_render_every == 0:
             if self.mode == 1:
                 self.get_static_renders()
             elif self.mode == 2:
@@ -227,6 +264,7 @@ class Simulation:
             self.close()
             return
         p.stepSimulation()
+        self._step_count += 1
 
     def get_robot(self):
         return self.robot